@@ -0,0 +1,127 @@
+"""
+对比 img2pdf(全部图片下载完后再生成) 与流式生成 PDF 的耗时和内存峰值
+
+用法：python benchmarks/pdf_benchmark.py [--pages 500] [--threads 10] [--latency 0.02]
+
+模拟多线程下载：每张图片等待 latency 秒后写入磁盘。每种方式在独立子进程中运行，
+分别统计总耗时、最后一张图片下载完成到 PDF 生成完毕的尾部耗时和进程内存峰值
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+from io import BytesIO
+import json
+from pathlib import Path
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+PDF_MODULE = Path(__file__).resolve().parent.parent / "nonebot_plugin_jmdownloader" / "pdf.py"
+
+
+def load_pdf_module():
+    """ 单独加载 pdf.py，避免导入插件本身 """
+    spec = importlib.util.spec_from_file_location("jm_pdf", PDF_MODULE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_sources(source_dir: Path, count: int):
+    """ 生成大小接近真实漫画页的 JPEG 图片 """
+    rng = random.Random(0)
+    for index in range(count):
+        image = Image.new("RGB", (1080, 1530), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        for _ in range(300):
+            x, y = rng.randrange(1080), rng.randrange(1530)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.ellipse((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)), fill=color)
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=85)
+        (source_dir / f"{index + 1:05}.jpg").write_bytes(output.getvalue())
+
+
+def simulate_download(sources: list[Path], target_dir: Path, threads: int, latency: float, on_done=None):
+    """ 多线程模拟下载，每张图片完成后调用 on_done(index, path) """
+    def download(index: int):
+        time.sleep(latency)
+        target = target_dir / sources[index].name
+        shutil.copyfile(sources[index], target)
+        if on_done is not None:
+            on_done(index, target)
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(download, range(len(sources))))
+
+
+def run(mode: str, source_dir: Path, work_dir: Path, threads: int, latency: float) -> dict:
+    sources = sorted(source_dir.iterdir())
+    output = work_dir / "out.pdf"
+    start = time.perf_counter()
+
+    if mode == "img2pdf":
+        import img2pdf
+
+        simulate_download(sources, work_dir, threads, latency)
+        downloaded = time.perf_counter()
+        with output.open("wb") as f:
+            f.write(img2pdf.convert(sorted(str(path) for path in work_dir.glob("*.jpg"))))
+    else:
+        pdf = load_pdf_module()
+        writer = pdf.StreamingPdfWriter(output, [work_dir / path.name for path in sources], title="benchmark")
+        simulate_download(sources, work_dir, threads, latency, lambda index, _: writer.page_done(index))
+        downloaded = time.perf_counter()
+        writer.finish()
+
+    end = time.perf_counter()
+    return {
+        "mode": mode,
+        "total": end - start,
+        "tail": end - downloaded,
+        # Linux 下单位为 KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "size_mb": output.stat().st_size / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟每张图片的下载耗时(秒)")
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "SOURCE", "WORK"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, source_dir, work_dir = args.worker
+        print(json.dumps(run(mode, Path(source_dir), Path(work_dir), args.threads, args.latency)))
+        return
+
+    with tempfile.TemporaryDirectory() as temp:
+        source_dir = Path(temp) / "source"
+        source_dir.mkdir()
+        print(f"生成{args.pages}张测试图片...")
+        make_sources(source_dir, args.pages)
+
+        print(f"{'方式':<10}{'总耗时':>10}{'尾部耗时':>10}{'内存峰值':>12}{'文件大小':>10}")
+        for mode in ("img2pdf", "stream"):
+            work_dir = Path(temp) / mode
+            work_dir.mkdir()
+            result = subprocess.run(
+                [sys.executable, __file__, "--threads", str(args.threads), "--latency", str(args.latency),
+                 "--worker", mode, str(source_dir), str(work_dir)],
+                capture_output=True, text=True, check=True,
+            )
+            r = json.loads(result.stdout)
+            print(f"{r['mode']:<10}{r['total']:>9.2f}s{r['tail']:>9.2f}s{r['peak_rss_mb']:>10.1f}MB{r['size_mb']:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,34 @@
-import asyncio
-import shutil
+from contextlib import ExitStack
+import json
 from pathlib import Path
 
-from jmcomic import (JmcomicException, JmDownloader,
-                     MissingAlbumPhotoException, create_option_by_str)
-from nonebot import logger, on_command, require
+import httpx
+from jmcomic import MissingAlbumPhotoException
+from nonebot import get_driver, logger, on_command, require
 from nonebot.adapters.onebot.v11 import (GROUP_ADMIN, GROUP_OWNER,
                                          ActionFailed, Bot, GroupMessageEvent,
-                                         Message, MessageEvent, MessageSegment,
-                                         PrivateMessageEvent)
+                                         Message, MessageEvent, MessageSegment)
 from nonebot.params import ArgPlainText, CommandArg
+from nonebot.matcher import Matcher
 from nonebot.permission import SUPERUSER
 from nonebot.plugin import PluginMetadata
 
-from .config import (Config, cache_dir, config_data, plugin_cache_dir,
+from .cache import TTLCache, cache_janitor, cover_cache, pdf_cache, photo_version
+from .concurrency import bulk_executor, metadata_executor, run_in_background
+from .config import (Config, plugin_cache_dir,
                      plugin_config)
 from .data_source import data_manager
-from .utils import (blur_image_async, check_group_and_user, check_permission,
-                    download_avatar, download_photo_async,
-                    get_photo_info_async, search_album_async,
-                    send_forward_message)
+from .image import image_worker
+from .network import domain_health, http_client
+from .pdf import ImageProfile, PdfDownloader
+from .session import jm_pool, option
+from .utils import (StageTimer, check_group_and_user, check_permission,
+                    download_album_async, download_photo_async, download_queue,
+                    get_album_info_async, get_blurred_cover, get_blurred_covers, get_cached_pdf,
+                    get_cached_photo_meta, get_photo_info_async, merge_album_async,
+                    get_photo_meta_async, parse_import_content, prefetch_search_page,
+                    rate_limit_wait, read_import_source, require_client, search_album_async, search_timings,
+                    send_forward_message, upload_file, upload_volumes)
 
 require("nonebot_plugin_apscheduler")
 
@@ -29,8 +38,10 @@ __plugin_meta__ = PluginMetadata(
     name="JMComic插件",
     description="JMComic搜索、下载插件，支持全局屏蔽jm号和tag，仅支持OnebotV11协议。",
     usage="jm下载 [jm号]：下载指定jm号的本子\n"
+          "jm下载全本 [jm号] [合并]：下载本子的所有章节\n"
           "jm查询 [jm号]：查询指定jm号的本子\n"
-          "jm搜索 [关键词]：搜索包含关键词的本子\n"
+          "jm搜索 [关键词] [页码]：搜索包含关键词的本子\n"
+          "jm下一页：查看上一次搜索的下一页\n"
           "jm设置文件夹 [文件夹名]：设置本群的本子储存文件夹\n",
     type="application",  # library
     homepage="https://github.com/Misty02600/nonebot-plugin-jmdownloader",
@@ -39,14 +50,37 @@ __plugin_meta__ = PluginMetadata(
     extra={"author": "Misty02600 <xiao02600@gmail.com>"},
 )
 
-option = create_option_by_str(config_data, mode="yml")
-print(option)
+image_profile = ImageProfile(
+    max_size=plugin_config.jmcomic_image_max_size,
+    quality=plugin_config.jmcomic_image_quality,
+    grayscale=plugin_config.jmcomic_image_grayscale,
+)
+downloader = PdfDownloader(
+    option,
+    plugin_cache_dir,
+    image_profile,
+    volume_pages=plugin_config.jmcomic_volume_pages,
+    volume_size=plugin_config.jmcomic_volume_size * 1024 * 1024,
+    page_retries=plugin_config.jmcomic_page_retries,
+    retry_delay=plugin_config.jmcomic_page_retry_delay,
+    image_threads=plugin_config.jmcomic_image_thread_budget,
+    version_of=photo_version,
+)
 
-try:
-    client = option.build_jm_client()
-    downloader = JmDownloader(option)
-except JmcomicException as e:
-    logger.error(f"初始化失败: { e }")
+# 记录每个会话最近一次搜索的 (关键词, 页码, 总页数)，用于 jm下一页
+last_searches = TTLCache(1024, 3600)
+
+driver = get_driver()
+# 客户端在后台登录，不阻塞 Bot 启动
+driver.on_startup(jm_pool.startup)
+driver.on_shutdown(jm_pool.shutdown)
+driver.on_startup(http_client.startup)
+driver.on_shutdown(http_client.shutdown)
+driver.on_shutdown(image_worker.shutdown)
+driver.on_shutdown(data_manager.close)
+driver.on_shutdown(pdf_cache.flush)
+driver.on_shutdown(metadata_executor.shutdown)
+driver.on_shutdown(bulk_executor.shutdown)
 
 # region jm功能指令
 jm_download = on_command("jm下载", aliases={"JM下载"}, block=True, rule=check_group_and_user)
@@ -58,70 +92,191 @@ async def _(bot: Bot, event: MessageEvent,arg: Message = CommandArg()):
     if not photo_id.isdigit():
         await jm_download.finish("请输入要下载的jm号")
 
+    if wait := rate_limit_wait(bot, event):
+        await jm_download.finish(f"操作太频繁了，请{wait}秒后再试")
+
     if str(user_id) not in bot.config.superusers:
         user_limit = data_manager.get_user_limit(user_id)
         if user_limit <= 0:
             await jm_download.finish(MessageSegment.at(user_id) + f"你的下载次数已经用完了！")
 
-    photo = await get_photo_info_async(client, photo_id)
-    if photo == 0:
-        await jm_download.finish("未查找到本子")
-    if photo is None:
-        await jm_download.finish("查询时发生错误")
+    # 从查找缓存开始标记使用中，避免命中的缓存在发送前被其他下载触发的清理删除
+    with cache_janitor.pin(photo_id):
+        cached_pdf = get_cached_pdf(photo_id)
+        if cached_pdf:
+            photo = cached_pdf
+        else:
+            client = await require_client(jm_download)
+            try:
+                photo = await get_photo_meta_async(client, photo_id)
+            except MissingAlbumPhotoException:
+                await jm_download.finish("未查找到本子")
+            if photo is None:
+                await jm_download.finish("查询时发生错误")
+
+        if data_manager.is_album_restricted(photo.id, photo.tags):
+            if isinstance(event, GroupMessageEvent):
+                try:
+                    await bot.set_group_ban(group_id=event.group_id, user_id=user_id, duration=86400)
+                except ActionFailed:
+                    pass
+                data_manager.add_blacklist(event.group_id, user_id)
+                await jm_download.finish(
+                    MessageSegment.at(user_id) + "该本子（或其tag）被禁止下载!你已被加入本群jm黑名单"
+                )
+            else:
+                await jm_download.finish("该本子（或其tag）被禁止下载！")
+
+        if not cached_pdf:
+            try:
+                photo_detail = await get_photo_info_async(client, photo_id)
+            except MissingAlbumPhotoException:
+                await jm_download.finish("未查找到本子")
+            if photo_detail is None:
+                await jm_download.finish("查询时发生错误")
+
+        if str(user_id) not in bot.config.superusers:
+            data_manager.decrease_user_limit(user_id, 1)
+            user_limit_new = data_manager.get_user_limit(user_id)
+            await jm_download.send(
+                f"查询到jm{photo.id}: {photo.title}\ntags:{photo.tags}\n"
+                f"开始下载...你本周还有{user_limit_new}次下载次数！"
+            )
+        else:
+            await jm_download.send(f"查询到jm{photo.id}: {photo.title}\ntags:{photo.tags}\n开始下载...")
+
+        # 新下载的文件按章节实际的 jm号 保存，同样标记使用中
+        with cache_janitor.pin(photo.id):
+            if cached_pdf:
+                pdf_paths = pdf_cache.paths_of(cached_pdf)
+            else:
+                pdf_paths = await download_photo_async(
+                    client, downloader, photo_detail,
+                    group_key=event.group_id if isinstance(event, GroupMessageEvent) else f"private_{user_id}",
+                    user_key=user_id,
+                    priority=str(user_id) in bot.config.superusers,
+                    on_queued=notify_queue_position
+                )
+                if pdf_paths is None:
+                    # 下载失败不消耗次数，已下载的图片会保留，重试时只下载缺少的部分
+                    if str(user_id) not in bot.config.superusers:
+                        data_manager.increase_user_limit(user_id, 1)
+                    await jm_download.finish("下载失败，已退还下载次数，稍后重试会继续下载")
+                # 新下载的图片可能使缓存超出预算，及时在后台清理
+                run_in_background(bulk_executor.run(cache_janitor.sweep))
+
+            failed = await upload_volumes(bot, event, pdf_paths, photo.idoname)
+
+    if len(failed) == len(pdf_paths):
+        await jm_download.finish("发送文件失败")
+    elif failed:
+        await jm_download.finish(f"共{len(pdf_paths)}卷，第{'、'.join(map(str, failed))}卷发送失败")
+
 
-    if data_manager.is_jm_id_restricted(photo.id) or data_manager.has_restricted_tag(photo.tags):
+jm_download_album = on_command("jm下载全本", aliases={"JM下载全本"}, block=True, rule=check_group_and_user)
+@jm_download_album.handle()
+async def _(bot: Bot, event: MessageEvent, arg: Message = CommandArg()):
+    args = arg.extract_plain_text().split()
+    user_id = event.user_id
+    is_superuser = str(user_id) in bot.config.superusers
+
+    if not args or not args[0].isdigit():
+        await jm_download_album.finish("请输入要下载的jm号，例如：jm下载全本 123456 合并")
+    album_id = args[0]
+    merge = "合并" in args[1:]
+
+    if wait := rate_limit_wait(bot, event):
+        await jm_download_album.finish(f"操作太频繁了，请{wait}秒后再试")
+
+    if not is_superuser and data_manager.get_user_limit(user_id) <= 0:
+        await jm_download_album.finish(MessageSegment.at(user_id) + "你的下载次数已经用完了！")
+
+    client = await require_client(jm_download_album)
+    try:
+        album = await get_album_info_async(client, album_id)
+    except MissingAlbumPhotoException:
+        await jm_download_album.finish("未查找到本子")
+    if album is None:
+        await jm_download_album.finish("查询时发生错误")
+
+    chapter_ids = [album.getindex(index).photo_id for index in range(len(album))]
+    if data_manager.is_album_restricted(album.album_id, album.tags) or any(
+        data_manager.is_jm_id_restricted(photo_id) for photo_id in chapter_ids
+    ):
         if isinstance(event, GroupMessageEvent):
             try:
                 await bot.set_group_ban(group_id=event.group_id, user_id=user_id, duration=86400)
             except ActionFailed:
                 pass
             data_manager.add_blacklist(event.group_id, user_id)
-            await jm_download.finish(MessageSegment.at(user_id) + "该本子（或其tag）被禁止下载!你已被加入本群jm黑名单")
+            await jm_download_album.finish(
+                MessageSegment.at(user_id) + "该本子（或其tag）被禁止下载!你已被加入本群jm黑名单"
+            )
         else:
-            await jm_download.finish("该本子（或其tag）被禁止下载！")
+            await jm_download_album.finish("该本子（或其tag）被禁止下载！")
 
-    if str(user_id) not in bot.config.superusers:
+    max_chapters = plugin_config.jmcomic_album_max_chapters
+    if max_chapters > 0 and len(chapter_ids) > max_chapters and not is_superuser:
+        await jm_download_album.finish(f"该本子共{len(chapter_ids)}章，超过了{max_chapters}章的上限")
+
+    # 整本只消耗一次下载次数
+    message = f"查询到jm{album.album_id}: {album.name}\n共{len(chapter_ids)}章，开始下载..."
+    if not is_superuser:
         data_manager.decrease_user_limit(user_id, 1)
-        user_limit_new = data_manager.get_user_limit(user_id)
-        await jm_download.send(
-            f"查询到jm{photo.id}: {photo.title}\ntags:{photo.tags}\n开始下载...你本周还有{user_limit_new}次下载次数！"
+        message += f"你本周还有{data_manager.get_user_limit(user_id)}次下载次数！"
+    await jm_download_album.send(message)
+
+    with ExitStack() as stack:
+        for key in {album.album_id, *chapter_ids}:
+            stack.enter_context(cache_janitor.pin(key))
+
+        results = await download_album_async(
+            client, downloader, album,
+            use_cache=not merge,
+            group_key=event.group_id if isinstance(event, GroupMessageEvent) else f"private_{user_id}",
+            user_key=user_id,
+            priority=is_superuser,
         )
-    else:
-        await jm_download.send(f"查询到jm{photo.id}: {photo.title}\ntags:{photo.tags}\n开始下载...")
+        run_in_background(bulk_executor.run(cache_janitor.sweep))
+        failed_chapters = [number for number, (_, paths) in enumerate(results, 1) if paths is None]
+
+        if merge:
+            # 合并时任一章节失败都不发送
+            pdf_paths = None
+            if not failed_chapters:
+                pdf_paths = await merge_album_async(downloader, album, [photo for photo, _ in results])
+            uploads = [(album.idoname, pdf_paths)] if pdf_paths else []
+        else:
+            uploads = [(f"{album.idoname}_{number}", paths) for number, (_, paths) in enumerate(results, 1) if paths]
 
-    try:
-        if not await download_photo_async(client, downloader, photo):
-            await jm_download.finish("下载失败")
+        if not uploads:
+            # 全部失败时退还下载次数，已下载的图片会保留，重试时只下载缺少的部分
+            if not is_superuser:
+                data_manager.increase_user_limit(user_id, 1)
+            await jm_download_album.finish("下载失败，已退还下载次数，稍后重试会继续下载")
 
-        if isinstance(event, GroupMessageEvent):
-            folder_id = data_manager.get_group_folder_id(event.group_id)
-
-            if folder_id:
-                await bot.call_api(
-                    "upload_group_file",
-                    group_id=event.group_id,
-                    file=f"{cache_dir}/{photo.id}.pdf",
-                    name=f"{photo.idoname}.pdf",
-                    folder_id=folder_id
-                )
-            else:
-                await bot.call_api(
-                    "upload_group_file",
-                    group_id=event.group_id,
-                    file=f"{cache_dir}/{photo.id}.pdf",
-                    name=f"{photo.idoname}.pdf"
-                )
+        failed_uploads = 0
+        for name, paths in uploads:
+            if await upload_volumes(bot, event, paths, name):
+                failed_uploads += 1
 
-        elif isinstance(event, PrivateMessageEvent):
-            await bot.call_api(
-                "upload_private_file",
-                user_id=event.user_id,
-                file=f"{cache_dir}/{photo.id}.pdf",
-                name=f"{photo.idoname}.pdf"
-            )
+        # 合并后的PDF不放入缓存，只属于本次请求，发送后删除
+        if merge:
+            for path in pdf_paths:
+                path.unlink(missing_ok=True)
 
+    if failed_chapters:
+        await jm_download_album.finish(f"共{len(chapter_ids)}章，第{'、'.join(map(str, failed_chapters))}章下载失败")
+    if failed_uploads:
+        await jm_download_album.finish(f"有{failed_uploads}个文件未能完整发送")
+
+
+async def notify_queue_position(position: int):
+    """ 下载任务需要排队时提示前面的任务数 """
+    try:
+        await jm_download.send(f"下载任务排队中，你前面还有{position}个任务")
     except ActionFailed:
-        await jm_download.finish("发送文件失败")
+        pass
 
 
 jm_query = on_command("jm查询", aliases={"JM查询"}, block=True, rule=check_group_and_user)
@@ -133,8 +288,15 @@ async def _(bot: Bot,event: MessageEvent,arg: Message = CommandArg()):
     if not photo_id.isdigit():
         await jm_query.finish("请输入要查询的jm号")
 
+    if wait := rate_limit_wait(bot, event):
+        await jm_query.finish(f"操作太频繁了，请{wait}秒后再试")
+
     try:
-        photo = await get_photo_info_async(client, photo_id)
+        # 命中缓存时不需要客户端，登录期间也能查询
+        photo = get_cached_photo_meta(photo_id)
+        if photo is None:
+            client = await require_client(jm_query)
+            photo = await get_photo_meta_async(client, photo_id)
     except MissingAlbumPhotoException:
         await jm_query.finish("未查找到本子")
 
@@ -142,10 +304,9 @@ async def _(bot: Bot,event: MessageEvent,arg: Message = CommandArg()):
         await jm_query.finish("查询时发生错误")
 
     message = Message(f'查询到jm{photo.id}: {photo.title}\ntags:{photo.tags}')
-    avatar = await download_avatar(photo.id)
+    avatar = await get_blurred_cover(photo.id)
 
     if avatar:
-        avatar = await blur_image_async(avatar)
         message += MessageSegment.image(avatar)
 
     message_node = MessageSegment("node", {"name": "jm查询结果", "content": message})
@@ -165,21 +326,61 @@ async def _(bot: Bot,event: MessageEvent,arg: Message = CommandArg()):
     if not search_query:
         await jm_search.finish("请输入要搜索的内容")
 
-    searching_msg_id = (await jm_search.send("正在搜索中..."))['message_id']
+    page_num = 1
+    words = search_query.split()
+    if len(words) > 1 and words[-1].isdigit():
+        page_num = max(1, int(words[-1]))
+        search_query = " ".join(words[:-1])
+
+    await send_search_page(bot, event, jm_search, search_query, page_num)
+
+
+jm_next_page = on_command("jm下一页", aliases={"JM下一页"}, block=True, rule=check_group_and_user)
+@jm_next_page.handle()
+async def _(bot: Bot, event: MessageEvent):
+    last_search = last_searches.get(event.get_session_id())
+    if last_search is None:
+        await jm_next_page.finish("请先使用 jm搜索 进行搜索")
+
+    search_query, page_num, page_count = last_search
+    if page_num >= page_count:
+        await jm_next_page.finish("已经是最后一页了")
+
+    await send_search_page(bot, event, jm_next_page, search_query, page_num + 1)
 
-    page = await search_album_async(client, search_query)
+
+async def send_search_page(bot: Bot, event: MessageEvent, matcher: type[Matcher], search_query: str, page_num: int):
+    """ 发送某一页搜索结果，并在后台预取下一页 """
+    if wait := rate_limit_wait(bot, event):
+        await matcher.finish(f"操作太频繁了，请{wait}秒后再试")
+
+    client = await require_client(matcher)
+    searching_msg_id = (await matcher.send("正在搜索中..."))['message_id']
+
+    timer = StageTimer()
+    with timer.stage("搜索"):
+        page = await search_album_async(client, search_query, page_num)
 
     if page is None:
-        await jm_search.finish("搜索失败", reply_message=True)
+        await matcher.finish("搜索失败", reply_message=True)
+
+    albums = [
+        (album_id, title)
+        for album_id, title, tags in page.iter_id_title_tag()
+        if not data_manager.is_album_restricted(album_id, tags)
+    ]
+    hidden_count = len(page) - len(albums)
 
     messages = []
-    avatars = await asyncio.gather(*(download_avatar(album_id) for album_id, _ in page))
+    avatars = await get_blurred_covers([album_id for album_id, _ in albums], timer)
+    timer.finish()
+    search_timings.append(timer)
+    logger.debug(f"jm搜索 {search_query} 第{page_num}页：{timer.summary()}")
 
-    for (album_id, title), avatar in zip(page, avatars):
+    for (album_id, title), avatar in zip(albums, avatars):
         message = Message(f'jm{album_id}: {title}')
 
         if avatar:
-            avatar = await blur_image_async(avatar)
             message += MessageSegment.image(avatar)
 
         message_node = MessageSegment("node", {"name": "jm搜索结果", "content": message})
@@ -187,13 +388,27 @@ async def _(bot: Bot,event: MessageEvent,arg: Message = CommandArg()):
 
     await bot.delete_msg(message_id=searching_msg_id)
 
+    page_count = page.page_count
+    last_searches.set(event.get_session_id(), (search_query, page_num, page_count))
+
     if not messages:
-        await jm_search.finish("未搜索到本子", reply_message=True)
+        if hidden_count and page_num < page_count:
+            await matcher.finish("本页的本子均被禁止，发送 jm下一页 查看下一页", reply_message=True)
+        await matcher.finish("未搜索到本子", reply_message=True)
+
+    if page_num < page_count:
+        run_in_background(prefetch_search_page(client, search_query, page_num + 1))
+        page_tip = f"第{page_num}/{page_count}页，发送 jm下一页 查看下一页"
+    else:
+        page_tip = f"第{page_num}/{page_count}页，已经是最后一页了"
+    if hidden_count:
+        page_tip += f"\n已隐藏{hidden_count}个被禁止的本子"
+    messages.append(MessageSegment("node", {"name": "jm搜索结果", "content": Message(page_tip)}))
 
     try:
         await send_forward_message(bot, event, messages)
     except ActionFailed:
-        await jm_search.finish("搜索结果发送失败", reply_message=True)
+        await matcher.finish("搜索结果发送失败", reply_message=True)
 
 
 jm_set_folder = on_command("jm设置文件夹", aliases={"JM设置文件夹"}, permission=SUPERUSER | GROUP_ADMIN | GROUP_OWNER, block=True)
@@ -383,14 +598,9 @@ jm_forbid_id = on_command("jm禁用id", aliases={"JM禁用id"}, permission=SUPER
 async def handle_jm_forbid_id(bot: Bot, event: MessageEvent, arg: Message = CommandArg()):
     raw_text = arg.extract_plain_text().strip()
 
-    jm_ids = raw_text.split()
-    success_list = []
-
-    for jm_id in jm_ids:
-        if not jm_id.isdigit():
-            continue
-        data_manager.add_restricted_jm_id(jm_id)
-        success_list.append(jm_id)
+    jm_ids = [jm_id for jm_id in raw_text.split() if jm_id.isdigit()]
+    data_manager.add_restricted_jm_ids(jm_ids)
+    success_list = list(dict.fromkeys(jm_ids))
 
     msg = ""
     if success_list:
@@ -405,13 +615,8 @@ async def handle_jm_forbid_tag(bot: Bot, event: MessageEvent, arg: Message = Com
     raw_text = arg.extract_plain_text().strip()
 
     tags = raw_text.split()
-    success_list = []
-
-    for tag in tags:
-        if not tag:
-            continue
-        data_manager.add_restricted_tag(tag)
-        success_list.append(tag)
+    data_manager.add_restricted_tags(tags)
+    success_list = list(dict.fromkeys(tags))
 
     msg = ""
     if success_list:
@@ -419,34 +624,89 @@ async def handle_jm_forbid_tag(bot: Bot, event: MessageEvent, arg: Message = Com
 
     await jm_forbid_tag.finish(msg.strip() or "没有做任何处理")
 
-# endregion
 
-@scheduler.scheduled_job("cron", day_of_week="mon", hour=0, minute=0, id="reset_user_limits")
-async def reset_user_limits():
-    """ 每周一凌晨0点重置所有用户的下载次数 """
+jm_import = on_command("jm导入", aliases={"JM导入"}, permission=SUPERUSER, block=True)
+@jm_import.handle()
+async def _(bot: Bot, event: MessageEvent, arg: Message = CommandArg()):
+    """ 从本地文件或群文件批量导入禁止列表和用户下载次数 """
+    source = arg.extract_plain_text().strip()
+    if not source:
+        await jm_import.finish("请输入本地文件路径或群文件名")
+
     try:
-        user_limits = data_manager.data.get("user_limits", {})
+        content = await read_import_source(bot, event, source)
+    except (OSError, ActionFailed, httpx.HTTPError) as e:
+        logger.warning(f"读取导入文件失败：{e}")
+        await jm_import.finish("读取文件失败")
 
-        if not user_limits:
-            logger.info("无用户下载数据可供重置。")
-            return
+    if content is None:
+        await jm_import.finish("未找到该文件")
 
-        for user_id in user_limits.keys():
-            data_manager.set_user_limit(int(user_id), plugin_config.jmcomic_user_limits)
+    try:
+        result = data_manager.import_data(parse_import_content(content))
+    except (UnicodeDecodeError, AttributeError, TypeError, ValueError) as e:
+        logger.warning(f"解析导入文件失败：{e}")
+        await jm_import.finish("文件格式错误")
 
-        logger.info("所有用户的下载次数已成功刷新")
+    await jm_import.finish(
+        f"导入完成：新增禁用jm号{result['restricted_ids']}个，禁用tag{result['restricted_tags']}个，"
+        f"禁止下载的本子{result['forbidden_albums']}个，更新用户下载次数{result['user_limits']}个"
+    )
 
-    except Exception as e:
-        logger.error(f"刷新用户下载次数时出错：{e}")
 
+jm_export = on_command("jm导出", aliases={"JM导出"}, permission=SUPERUSER, block=True)
+@jm_export.handle()
+async def _(bot: Bot, event: MessageEvent):
+    """ 导出禁止列表和用户下载次数为 JSON 文件 """
+    export_path = plugin_cache_dir / "jmcomic_export.json"
+    content = json.dumps(data_manager.export_data(), indent=4, ensure_ascii=False)
+    await metadata_executor.run(export_path.write_text, content, encoding="utf-8")
+
+    try:
+        await upload_file(bot, event, export_path, export_path.name)
+    except ActionFailed:
+        await jm_export.finish("发送文件失败")
+
+# endregion
+
+# region 运行状态
+jm_status = on_command("jm状态", aliases={"JM状态"}, permission=SUPERUSER, block=True)
+@jm_status.handle()
+async def _():
+    """ 查看插件的运行状态 """
+    if search_timings:
+        average = sum(timer.elapsed for timer in search_timings) / len(search_timings)
+        search_stats = f"最近{len(search_timings)}次平均{average:.2f}s\n最近一次：{search_timings[-1].summary()}"
+    else:
+        search_stats = "暂无记录"
+
+    msg = (
+        f"JM会话：\n{jm_pool.stats()}\n"
+        f"搜索耗时：{search_stats}\n"
+        f"下载队列：进行中{download_queue.running}个，排队{download_queue.waiting}个\n"
+        f"封面缓存：{cover_cache.stats()}\n"
+        f"下载缓存：{cache_janitor.stats()}\n"
+        f"数据写入：{data_manager.stats()}\n"
+        f"图片压缩：{downloader.stats()}\n"
+        f"断点续传：{downloader.resume_stats()}\n"
+        f"元数据线程池：{metadata_executor.stats()}\n"
+        f"下载线程池：{bulk_executor.stats()}\n"
+        f"图片处理：{image_worker.stats()}\n"
+        f"封面连接池：{http_client.stats()}\n"
+        f"图片域名：\n{domain_health.summary()}"
+    )
+    await jm_status.finish(msg)
+
+# endregion
+
+if plugin_config.jmcomic_relogin_interval > 0:
+    scheduler.add_job(jm_pool.refresh, "interval", minutes=plugin_config.jmcomic_relogin_interval, id="jm_relogin")
 
-@scheduler.scheduled_job("cron", hour=3, minute=0)
-async def clear_cache_dir():
-    """ 每天凌晨3点清理缓存文件夹 """
+@scheduler.scheduled_job("interval", minutes=max(1, plugin_config.jmcomic_cache_sweep_interval), id="sweep_cache_dir")
+async def sweep_cache_dir():
+    """ 定期在后台清理下载产生的文件，保留PDF成品、封面和本子信息缓存，并写入PDF缓存的访问记录 """
     try:
-        if plugin_cache_dir.exists():
-            shutil.rmtree(plugin_cache_dir)
-            plugin_cache_dir.mkdir(parents=True, exist_ok=True)
-            logger.info(f"已成功清理缓存目录：{cache_dir}")
+        await bulk_executor.run(pdf_cache.flush)
+        await bulk_executor.run(cache_janitor.sweep)
     except Exception as e:
         logger.error(f"清理缓存目录失败：{e}")
\ No newline at end of file
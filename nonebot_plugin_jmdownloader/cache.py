@@ -0,0 +1,642 @@
+from collections import Counter, OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from hashlib import md5
+import json
+import os
+from pathlib import Path
+import shutil
+from threading import Lock, RLock
+import time
+from typing import Any
+from uuid import uuid4
+
+from jmcomic import JmPhotoDetail
+from nonebot import logger
+
+from .config import plugin_cache_dir, plugin_config
+from .data_source import atomic_write_text
+
+
+def photo_version(photo: JmPhotoDetail) -> str:
+    """ 根据章节的图片列表计算版本号，章节内容更新后版本号随之变化 """
+    return md5("\n".join(photo.page_arr or []).encode("utf-8")).hexdigest()[:8]
+
+
+@dataclass
+class PdfArtifact:
+    """ 缓存中的一个 PDF 成品，同时保存发送文件所需的本子信息 """
+    id: str
+    version: str
+    title: str
+    idoname: str
+    tags: list[str] = field(default_factory=list)
+    size: int = 0
+    created: float = 0.0
+    last_access: float = 0.0
+    volumes: int = 1
+
+    @property
+    def filenames(self) -> list[str]:
+        if self.volumes == 1:
+            return [f"{self.id}_{self.version}.pdf"]
+        return [f"{self.id}_{self.version}_part{number}.pdf" for number in range(1, self.volumes + 1)]
+
+
+class CacheJanitor:
+    """
+    清理下载过程产生的文件(图片目录、未放入缓存的 PDF 等)
+
+    以 jm号 为单位统计占用大小和最近使用时间，超过有效期或总大小超出预算时按最近使用时间淘汰。
+    正在被下载、上传任务使用的 jm号 会被标记，不会被删除
+    """
+
+    TRASH_PREFIX = ".trash-"
+
+    def __init__(self, cache_dir: Path, budget: int, max_age: int, exclude: set[str]):
+        self.cache_dir = cache_dir
+        self.budget = budget * 1024 * 1024
+        self.max_age = max_age
+        self.exclude = exclude
+        self.removed_entries = 0
+        self.removed_bytes = 0
+        self.last_total = 0
+        self._pins: Counter[str] = Counter()
+        self._touched: dict[str, float] = {}
+        self._lock = Lock()
+        self._sweep_lock = Lock()
+
+    @staticmethod
+    def owner(name: str) -> str:
+        """ 文件或目录所属的 jm号，如 123、123.pdf、123_part2.pdf.part 都属于 123 """
+        return name.split(".")[0].split("_")[0]
+
+    @contextmanager
+    def pin(self, key: str) -> Iterator[None]:
+        """ 任务进行期间标记该 jm号 正在使用 """
+        key = str(key)
+        with self._lock:
+            self._pins[key] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if self._pins[key] <= 0:
+                    del self._pins[key]
+                self._touched[key] = time.time()
+
+    def is_pinned(self, key: str) -> bool:
+        with self._lock:
+            return str(key) in self._pins
+
+    @staticmethod
+    def _measure(path: Path) -> tuple[int, float]:
+        """ 返回文件或目录的总大小和最后修改时间 """
+        stat = path.stat()
+        if not path.is_dir():
+            return stat.st_size, stat.st_mtime
+
+        size, mtime = 0, stat.st_mtime
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    file_stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                size += file_stat.st_size
+                mtime = max(mtime, file_stat.st_mtime)
+        return size, mtime
+
+    def _scan(self) -> list[tuple[Path, str, int, float]]:
+        """ 列出可清理的条目：(路径, jm号, 大小, 最近使用时间) """
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.name in self.exclude or path.name.startswith(self.TRASH_PREFIX):
+                continue
+            try:
+                size, mtime = self._measure(path)
+            except OSError:
+                continue
+            key = self.owner(path.name)
+            entries.append((path, key, size, max(mtime, self._touched.get(key, 0.0))))
+        return entries
+
+    def _remove(self, path: Path, key: str) -> bool:
+        """ 先在锁内改名移出，再删除，避免删除期间有新任务开始使用 """
+        trash = self.cache_dir / f"{self.TRASH_PREFIX}{uuid4().hex}"
+        with self._lock:
+            if key in self._pins:
+                return False
+            try:
+                path.rename(trash)
+            except OSError:
+                return False
+
+        if trash.is_dir():
+            shutil.rmtree(trash, ignore_errors=True)
+        else:
+            trash.unlink(missing_ok=True)
+        return True
+
+    def sweep(self):
+        """ 淘汰过期和超出预算的条目，应在线程中运行，同一时刻只运行一次 """
+        if not self.cache_dir.exists() or not self._sweep_lock.acquire(blocking=False):
+            return
+
+        try:
+            # 清理上次中断时残留的待删除文件
+            for path in self.cache_dir.glob(f"{self.TRASH_PREFIX}*"):
+                shutil.rmtree(path, ignore_errors=True) if path.is_dir() else path.unlink(missing_ok=True)
+
+            entries = self._scan()
+            total = sum(size for _, _, size, _ in entries)
+            now = time.time()
+
+            for path, key, size, last_used in sorted(entries, key=lambda entry: entry[3]):
+                expired = self.max_age > 0 and now - last_used > self.max_age
+                over_budget = self.budget > 0 and total > self.budget
+                if not expired and not over_budget:
+                    break
+                if self._remove(path, key):
+                    total -= size
+                    self.removed_entries += 1
+                    self.removed_bytes += size
+                    logger.debug(f"已清理缓存 {path.name}")
+
+            self.last_total = total
+            with self._lock:
+                self._touched = {k: v for k, v in self._touched.items() if now - v <= self.max_age or k in self._pins}
+        finally:
+            self._sweep_lock.release()
+
+    def stats(self) -> str:
+        return (
+            f"占用{self.last_total / 1024 / 1024:.1f}MB，使用中{len(self._pins)}个，"
+            f"已清理{self.removed_entries}项({self.removed_bytes / 1024 / 1024:.1f}MB)"
+        )
+
+
+class PdfCache:
+    """
+    以 jm号+章节版本 为键的 PDF 成品缓存，分卷的本子整体缓存，超出容量时按最近访问时间淘汰
+
+    下载线程和事件循环都会访问缓存，所有方法都在同一把锁内执行
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int, ttl: int = 0, janitor: CacheJanitor | None = None):
+        self.cache_dir = cache_dir
+        self.index_path = cache_dir / "index.json"
+        self.max_size = max_size
+        self.ttl = ttl
+        self.janitor = janitor
+        self.artifacts: dict[str, PdfArtifact] = {}
+        self._lock = RLock()
+        # 命中时只更新内存中的访问时间，由 flush 定期写入索引
+        self._dirty = False
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @property
+    def total_size(self) -> int:
+        return sum(artifact.size for artifact in self.artifacts.values())
+
+    def _load_index(self):
+        """ 加载缓存索引，丢弃文件已不存在的条目，并删除索引中没有记录的 PDF """
+        if self.index_path.exists():
+            known = {f.name for f in fields(PdfArtifact)}
+            try:
+                with self.index_path.open("r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                self.artifacts = {
+                    photo_id: PdfArtifact(**{k: v for k, v in item.items() if k in known})
+                    for photo_id, item in raw.items()
+                }
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.error(f"PDF缓存索引读取错误：{e}")
+                self.artifacts = {}
+
+        for photo_id, artifact in list(self.artifacts.items()):
+            if not self.exists(artifact):
+                del self.artifacts[photo_id]
+            elif not artifact.created:
+                # 旧版本索引没有创建时间
+                artifact.created = artifact.last_access
+
+        referenced = {name for artifact in self.artifacts.values() for name in artifact.filenames}
+        for path in self.cache_dir.glob("*.pdf"):
+            if path.name not in referenced:
+                path.unlink(missing_ok=True)
+                logger.debug(f"删除没有索引的PDF缓存：{path.name}")
+
+    def _expired(self, artifact: PdfArtifact) -> bool:
+        return self.ttl > 0 and time.time() - artifact.created > self.ttl
+
+    def save(self):
+        """ 保存缓存索引，先写临时文件再替换，避免写入中途崩溃导致索引损坏 """
+        with self._lock:
+            self._dirty = False
+            try:
+                atomic_write_text(
+                    self.index_path,
+                    json.dumps({pid: asdict(a) for pid, a in self.artifacts.items()}, ensure_ascii=False),
+                )
+            except Exception as e:
+                logger.error(f"保存PDF缓存索引出错：{e}")
+
+    def flush(self):
+        """ 写入命中缓存时更新的访问时间，在线程中定期调用 """
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    def paths_of(self, artifact: PdfArtifact) -> list[Path]:
+        return [self.cache_dir / filename for filename in artifact.filenames]
+
+    def exists(self, artifact: PdfArtifact) -> bool:
+        return all(path.exists() for path in self.paths_of(artifact))
+
+    def get(self, photo_id: str, version: str | None = None) -> PdfArtifact | None:
+        """
+        命中时更新访问时间并返回缓存条目
+
+        传入章节当前的版本号时，版本不一致的缓存视为过期；否则按有效期判断是否过期
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            artifact = self.artifacts.get(str(photo_id))
+            if artifact is None:
+                return None
+
+            stale = artifact.version != version if version is not None else self._expired(artifact)
+            if stale or not self.exists(artifact):
+                # 与命中时一样只标记待写入，由 flush 统一保存，不在事件循环中写文件
+                self.discard(artifact.id)
+                self._dirty = True
+                return None
+
+            artifact.last_access = time.time()
+            self._dirty = True
+            return artifact
+
+    def put(self, photo: JmPhotoDetail, pdf_paths: list[Path]) -> list[Path]:
+        """ 将下载好的 PDF (各分卷) 移入缓存，返回缓存后的文件路径 """
+        if not self.enabled or not all(path.exists() for path in pdf_paths):
+            return pdf_paths
+
+        with self._lock:
+            return self._put(photo, pdf_paths)
+
+    def _put(self, photo: JmPhotoDetail, pdf_paths: list[Path]) -> list[Path]:
+        self.discard(photo.id)
+
+        artifact = PdfArtifact(
+            id=str(photo.id),
+            version=photo_version(photo),
+            title=photo.title,
+            idoname=photo.idoname,
+            tags=list(photo.tags),
+            size=sum(path.stat().st_size for path in pdf_paths),
+            created=time.time(),
+            last_access=time.time(),
+            volumes=len(pdf_paths),
+        )
+        targets = self.paths_of(artifact)
+        for path, target in zip(pdf_paths, targets):
+            shutil.move(path, target)
+
+        self.artifacts[artifact.id] = artifact
+        self.evict(keep=artifact.id)
+        self.save()
+        return targets
+
+    def discard(self, photo_id: str):
+        """ 删除某个本子的缓存 """
+        with self._lock:
+            artifact = self.artifacts.pop(str(photo_id), None)
+            if artifact is not None:
+                for path in self.paths_of(artifact):
+                    path.unlink(missing_ok=True)
+
+    def evict(self, keep: str | None = None):
+        """ 按最近访问时间淘汰缓存，直到总大小不超过上限 """
+        with self._lock:
+            limit = self.max_size * 1024 * 1024
+            total = self.total_size
+
+            for artifact in sorted(self.artifacts.values(), key=lambda a: a.last_access):
+                if total <= limit:
+                    break
+                if artifact.id == keep:
+                    continue
+                # 正在发送的 PDF 不淘汰
+                if self.janitor is not None and self.janitor.is_pinned(artifact.id):
+                    continue
+
+                self.discard(artifact.id)
+                total -= artifact.size
+                logger.debug(f"PDF缓存已淘汰 jm{artifact.id}")
+
+
+class TTLCache:
+    """ 带有效期的内存 LRU 缓存 """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires, value = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: float | None = None):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+
+@dataclass
+class PhotoMeta:
+    """ 章节的基本信息，足以用于禁止下载检查和查询回复 """
+    id: str
+    title: str
+    idoname: str
+    tags: list[str] = field(default_factory=list)
+    page_count: int = 0
+
+    @classmethod
+    def from_photo(cls, photo: JmPhotoDetail) -> "PhotoMeta":
+        return cls(
+            id=str(photo.id),
+            title=photo.title,
+            idoname=photo.idoname,
+            tags=list(photo.tags),
+            page_count=len(photo),
+        )
+
+
+class MetadataCache:
+    """
+    章节信息缓存，不存在的jm号也会以较短的有效期缓存
+
+    内存中按有效期保存，变更追加写入本地文件，启动时加载并压缩文件
+    """
+
+    MISSING = "missing"
+
+    def __init__(self, path: Path, maxsize: int, ttl: int, negative_ttl: int):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = TTLCache(maxsize, ttl)
+        self.expires: dict[str, float] = {}
+        self._appended = 0
+        self._lock = Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """ 读取追加日志，保留每个jm号最后一条未过期的记录 """
+        if not self.path.exists():
+            return
+
+        now = time.time()
+        records: dict[str, dict] = {}
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records[record["id"]] = record
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+
+        for photo_id, record in records.items():
+            remaining = record["expires"] - now
+            if remaining <= 0:
+                continue
+            value = self.MISSING if record["meta"] is None else PhotoMeta(**record["meta"])
+            self.memory.set(photo_id, value, ttl=remaining)
+            self.expires[photo_id] = record["expires"]
+
+        self._compact()
+
+    def _compact(self):
+        """ 只保留内存中仍有效的记录，原子地重写文件 """
+        temp_path = self.path.with_suffix(".tmp")
+        with temp_path.open("w", encoding="utf-8") as f:
+            for photo_id, expires in self.expires.items():
+                value = self.memory.get(photo_id)
+                if value is None:
+                    continue
+                meta = None if value == self.MISSING else asdict(value)
+                f.write(json.dumps({"id": photo_id, "expires": expires, "meta": meta}, ensure_ascii=False) + "\n")
+        temp_path.replace(self.path)
+
+        self.expires = {photo_id: e for photo_id, e in self.expires.items() if self.memory.get(photo_id) is not None}
+        self._appended = 0
+
+    def _append(self, photo_id: str, meta: PhotoMeta | None, ttl: int):
+        if ttl <= 0 or self.ttl <= 0:
+            return
+
+        expires = time.time() + ttl
+        with self._lock:
+            self.memory.set(photo_id, self.MISSING if meta is None else meta, ttl=ttl)
+            self.expires[photo_id] = expires
+            try:
+                with self.path.open("a", encoding="utf-8") as f:
+                    record = {"id": photo_id, "expires": expires, "meta": None if meta is None else asdict(meta)}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._appended += 1
+                if self._appended > max(self.memory.maxsize, 100):
+                    self._compact()
+            except OSError as e:
+                logger.warning(f"章节信息缓存写入失败：{e}")
+
+    def get(self, photo_id: str) -> PhotoMeta | None:
+        with self._lock:
+            value = self.memory.get(str(photo_id))
+        return None if value is None or value == self.MISSING else value
+
+    def is_missing(self, photo_id: str) -> bool:
+        with self._lock:
+            return self.memory.get(str(photo_id)) == self.MISSING
+
+    def set(self, meta: PhotoMeta):
+        self._append(meta.id, meta, self.ttl)
+
+    def set_missing(self, photo_id: str):
+        self._append(str(photo_id), None, self.negative_ttl)
+
+
+class CoverCache:
+    """ 模糊封面的两级缓存：内存 LRU + 本地磁盘，按有效期和容量淘汰 """
+
+    def __init__(self, cache_dir: Path, ttl: int, memory_size: int, disk_size: int):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory_limit = memory_size * 1024 * 1024
+        self.disk_limit = disk_size * 1024 * 1024
+
+        self.memory: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_index: dict[str, tuple[float, int]] = {}
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.cache_dir.glob("*.jpg"):
+            stat = path.stat()
+            self.disk_index[path.stem] = (stat.st_mtime, stat.st_size)
+            self.disk_bytes += stat.st_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _expired(self, created: float) -> bool:
+        return time.time() - created >= self.ttl
+
+    def get(self, album_id: str) -> bytes | None:
+        """ 依次查找内存和磁盘，过期的条目会被删除 """
+        if not self.enabled:
+            return None
+
+        key = str(album_id)
+        with self._lock:
+            item = self.memory.get(key)
+            if item is not None:
+                if not self._expired(item[0]):
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                self._drop_memory(key)
+
+            entry = self.disk_index.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    try:
+                        data = (self.cache_dir / f"{key}.jpg").read_bytes()
+                    except OSError:
+                        self._drop_disk(key)
+                    else:
+                        self._put_memory(key, entry[0], data)
+                        self.hits += 1
+                        return data
+                else:
+                    self._drop_disk(key)
+
+            self.misses += 1
+            return None
+
+    def put(self, album_id: str, data: bytes):
+        """ 写入内存和磁盘，超出容量时淘汰最旧的条目 """
+        if not self.enabled:
+            return
+
+        key = str(album_id)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, data)
+
+            if self.disk_limit <= 0:
+                return
+
+            self._drop_disk(key)
+            try:
+                (self.cache_dir / f"{key}.jpg").write_bytes(data)
+            except OSError as e:
+                logger.warning(f"封面缓存写入失败：{e}")
+                return
+            self.disk_index[key] = (now, len(data))
+            self.disk_bytes += len(data)
+
+            if self.disk_bytes > self.disk_limit:
+                for old_key, _ in sorted(self.disk_index.items(), key=lambda item: item[1][0]):
+                    if self.disk_bytes <= self.disk_limit:
+                        break
+                    self._drop_disk(old_key)
+
+    def _put_memory(self, key: str, created: float, data: bytes):
+        self._drop_memory(key)
+        self.memory[key] = (created, data)
+        self.memory_bytes += len(data)
+
+        while self.memory_bytes > self.memory_limit and self.memory:
+            self._drop_memory(next(iter(self.memory)))
+
+    def _drop_memory(self, key: str):
+        item = self.memory.pop(key, None)
+        if item is not None:
+            self.memory_bytes -= len(item[1])
+
+    def _drop_disk(self, key: str):
+        entry = self.disk_index.pop(key, None)
+        if entry is not None:
+            self.disk_bytes -= entry[1]
+            (self.cache_dir / f"{key}.jpg").unlink(missing_ok=True)
+
+    def stats(self) -> str:
+        return (
+            f"命中{self.hits}次，未命中{self.misses}次，"
+            f"内存{len(self.memory)}张({self.memory_bytes / 1024 / 1024:.1f}MB)，"
+            f"磁盘{len(self.disk_index)}张({self.disk_bytes / 1024 / 1024:.1f}MB)"
+        )
+
+
+cache_janitor = CacheJanitor(
+    plugin_cache_dir,
+    plugin_config.jmcomic_cache_budget,
+    plugin_config.jmcomic_cache_max_age,
+    exclude={"pdf", "covers", "metadata"},
+)
+pdf_cache = PdfCache(
+    plugin_cache_dir / "pdf",
+    plugin_config.jmcomic_pdf_cache_size,
+    plugin_config.jmcomic_pdf_cache_ttl,
+    cache_janitor,
+)
+metadata_cache = MetadataCache(
+    plugin_cache_dir / "metadata" / "photos.jsonl",
+    plugin_config.jmcomic_metadata_cache_size,
+    plugin_config.jmcomic_metadata_cache_ttl,
+    plugin_config.jmcomic_metadata_negative_ttl,
+)
+cover_cache = CoverCache(
+    plugin_cache_dir / "covers",
+    plugin_config.jmcomic_cover_cache_ttl,
+    plugin_config.jmcomic_cover_cache_memory,
+    plugin_config.jmcomic_cover_cache_disk,
+)
@@ -0,0 +1,295 @@
+import asyncio
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable, Coroutine, Hashable, Iterator
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+import time
+from typing import Any
+
+from nonebot import logger
+
+from .config import plugin_config
+
+background_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """ 在后台运行协程，持有任务引用直到完成，异常只记录日志 """
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+
+    def done(task: asyncio.Task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"后台任务出错：{task.exception()}")
+
+    task.add_done_callback(done)
+    return task
+
+
+class SingleFlight:
+    """ 合并相同键的并发调用，同一时刻每个键只执行一次，所有等待者共享同一结果 """
+
+    def __init__(self):
+        self._futures: dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._futures
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._futures.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._futures[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+
+        # 某个等待者被取消时不影响共享的任务和其他等待者
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._futures.get(key) is future:
+            del self._futures[key]
+
+
+class BoundedExecutor:
+    """
+    某一类阻塞任务专用的执行器
+
+    任务先在事件循环中排队，取得名额后才提交给线程池，线程池本身不积压任务，
+    因此可以准确统计排队数和排队等待时间。不同类别的任务互不占用线程
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._executor: Executor | None = None
+        self._waits: deque[float] = deque(maxlen=100)
+
+    @property
+    def unit(self) -> str:
+        return "线程"
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=f"jm-{self.name}")
+        return self._executor
+
+    def _done(self, _future: Future | None = None):
+        self.running -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """ 排队取得名额后在执行器中运行 func """
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self._waits.append(time.monotonic() - start)
+
+        self.running += 1
+        try:
+            future = self._get_executor().submit(func, *args, **kwargs)
+        except BaseException:
+            self._done()
+            raise
+
+        # 调用方被取消时任务仍在执行，等它真正结束后再释放名额
+        loop = asyncio.get_running_loop()
+
+        def release(future: Future):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._done, future)
+
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> str:
+        status = f"{self.workers}{self.unit}，进行中{self.running}个，排队{self.waiting}个，已完成{self.completed}个"
+        if self._waits:
+            average = sum(self._waits) / len(self._waits)
+            status += f"，最近{len(self._waits)}次平均等待{average:.2f}s，最长{max(self._waits):.2f}s"
+        return status
+
+
+class RateLimiter:
+    """ 滑动窗口限流：每个键在 window 秒内最多允许 limit 次请求，limit 为0时不限制 """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits: dict[Hashable, deque[float]] = {}
+
+    def _prune(self, now: float):
+        """ 丢弃已移出窗口的记录，并删除没有记录的键 """
+        for key, hits in list(self._hits.items()):
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            if not hits:
+                del self._hits[key]
+
+    def wait_time(self, key: Hashable) -> float:
+        """ 返回该键还需等待的秒数，为0时可以请求 """
+        if self.limit <= 0:
+            return 0.0
+
+        hits = self._hits.get(key)
+        if not hits:
+            return 0.0
+
+        now = time.monotonic()
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if len(hits) < self.limit:
+            return 0.0
+        return hits[0] + self.window - now
+
+    def hit(self, key: Hashable):
+        """ 记录一次请求 """
+        if self.limit <= 0:
+            return
+
+        now = time.monotonic()
+        # 键的数量过多时顺带清理过期的键，避免长期运行后占用内存
+        if len(self._hits) > 1024:
+            self._prune(now)
+        self._hits.setdefault(key, deque()).append(now)
+
+
+class DownloadQueue:
+    """ 下载任务队列：限制同时下载的本子数，按群、群内用户轮转调度，超级用户优先 """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max(1, max_workers)
+        self.running = 0
+        self._priority: deque[asyncio.Future] = deque()
+        self._lanes: OrderedDict[Hashable, OrderedDict[Hashable, deque[asyncio.Future]]] = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _ in self._iter_order())
+
+    def _iter_order(self) -> Iterator[asyncio.Future]:
+        """ 按调度顺序列出正在排队的任务 """
+        yield from self._priority
+
+        groups = deque(
+            (group_key, deque((user_key, deque(queue)) for user_key, queue in users.items()))
+            for group_key, users in self._lanes.items()
+        )
+        while groups:
+            group_key, users = groups.popleft()
+            user_key, queue = users.popleft()
+            yield queue.popleft()
+            if queue:
+                users.append((user_key, queue))
+            if users:
+                groups.append((group_key, users))
+
+    def position(self, waiter: asyncio.Future) -> int:
+        """ 返回排在该任务前面的任务数 """
+        for index, item in enumerate(self._iter_order()):
+            if item is waiter:
+                return index
+        return 0
+
+    def _next(self) -> asyncio.Future | None:
+        if self._priority:
+            return self._priority.popleft()
+
+        if not self._lanes:
+            return None
+
+        group_key, users = self._lanes.popitem(last=False)
+        user_key, queue = users.popitem(last=False)
+        waiter = queue.popleft()
+
+        # 被调度过的用户和群移到队尾
+        if queue:
+            users[user_key] = queue
+        if users:
+            self._lanes[group_key] = users
+
+        return waiter
+
+    def _remove(self, waiter: asyncio.Future):
+        if waiter in self._priority:
+            self._priority.remove(waiter)
+            return
+
+        for group_key, users in list(self._lanes.items()):
+            for user_key, queue in list(users.items()):
+                if waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del users[user_key]
+                    if not users:
+                        del self._lanes[group_key]
+                    return
+
+    def _wakeup(self):
+        while self.running < self.max_workers:
+            waiter = self._next()
+            if waiter is None:
+                return
+            if waiter.done():
+                continue
+
+            self.running += 1
+            waiter.set_result(None)
+
+    def _release(self):
+        self.running -= 1
+        self._wakeup()
+
+    async def run(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        group_key: Hashable,
+        user_key: Hashable,
+        priority: bool = False,
+        on_queued: Callable[[int], Awaitable[Any]] | None = None,
+    ) -> Any:
+        """ 排队执行 func，需要等待时以前面的任务数调用 on_queued """
+        waiter = asyncio.get_running_loop().create_future()
+
+        if priority:
+            self._priority.append(waiter)
+        else:
+            self._lanes.setdefault(group_key, OrderedDict()).setdefault(user_key, deque()).append(waiter)
+
+        self._wakeup()
+
+        try:
+            if not waiter.done() and on_queued is not None:
+                await on_queued(self.position(waiter))
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                waiter.cancel()
+                self._remove(waiter)
+            raise
+
+        try:
+            return await func()
+        finally:
+            self._release()
+
+
+# 查询、搜索、缓存读写等短任务
+metadata_executor = BoundedExecutor("元数据", plugin_config.jmcomic_metadata_workers)
+# 下载章节、合并PDF、清理缓存等长任务，避免占满线程后拖慢查询
+bulk_executor = BoundedExecutor("下载", plugin_config.jmcomic_bulk_workers)
@@ -14,8 +14,69 @@ class Config(BaseModel):
     jmcomic_thread_count: int = Field(default=10, description="下载线程数量")
     jmcomic_username: str = Field(description="JM登录用户名")
     jmcomic_password: str = Field(description="JM登录密码")
+    jmcomic_extra_accounts: dict[str, str] = Field(
+        default={}, description="额外的JM账号，用户名: 密码，与主账号一起组成客户端池"
+    )
+    jmcomic_sessions_per_account: int = Field(default=1, description="每个账号登录的会话数")
+    jmcomic_session_failure_threshold: int = Field(default=3, description="会话连续失败多少次后暂时停用并重新登录")
+    jmcomic_login_timeout: int = Field(default=15, description="指令等待客户端登录完成的最长时间(秒)")
+    jmcomic_relogin_interval: int = Field(default=360, description="定时重新登录的间隔(分钟)，为0时不定时登录")
     jmcomic_allow_groups: bool = Field(default=False, description="是否默认启用所有群")
     jmcomic_user_limits: int = Field(default=5, description="每位用户的每周下载限制次数")
+    jmcomic_user_rate_limit: int = Field(default=5, description="每位用户在时间窗口内最多使用的指令次数，为0时不限制")
+    jmcomic_group_rate_limit: int = Field(default=20, description="每个群在时间窗口内最多使用的指令次数，为0时不限制")
+    jmcomic_rate_limit_window: int = Field(default=60, description="指令频率限制的时间窗口(秒)")
+    jmcomic_download_workers: int = Field(default=2, description="同时下载的本子数量")
+    jmcomic_image_thread_budget: int = Field(default=0, description="所有下载任务共享的图片下载线程数上限，为0时不限制")
+    jmcomic_album_concurrency: int = Field(default=2, description="下载全本时同时下载的章节数")
+    jmcomic_album_max_chapters: int = Field(default=50, description="下载全本时允许的最大章节数，为0时不限制")
+    jmcomic_image_max_size: int = Field(default=0, description="打包前将本子图片缩小到该最长边(像素)以内，为0时不缩小")
+    jmcomic_image_quality: int = Field(
+        default=0, description="打包前将本子图片重新压缩为该JPEG质量(1-95)，为0时不重新压缩"
+    )
+    jmcomic_image_grayscale: bool = Field(default=False, description="打包前是否将本子图片转为灰度")
+    jmcomic_volume_pages: int = Field(default=0, description="每卷PDF的最大页数，超出时分卷发送，为0时不按页数分卷")
+    jmcomic_volume_size: int = Field(default=0, description="每卷PDF的最大大小(MB)，超出时分卷发送，为0时不按大小分卷")
+    jmcomic_upload_concurrency: int = Field(default=2, description="同时上传的分卷数")
+    jmcomic_upload_retries: int = Field(default=2, description="分卷上传失败后的重试次数")
+    jmcomic_upload_timeout: float = Field(default=600, description="上传文件的超时时间(秒)")
+    jmcomic_page_retries: int = Field(default=3, description="单张图片下载失败后的重试次数")
+    jmcomic_page_retry_delay: float = Field(default=1.0, description="图片重试的初始等待时间(秒)，每次重试翻倍")
+    jmcomic_pdf_cache_size: int = Field(default=2048, description="PDF缓存容量上限(MB)，为0时不缓存")
+    jmcomic_pdf_cache_ttl: int = Field(
+        default=604800, description="PDF缓存的有效期(秒)，无法校验章节版本时使用，为0时不限制"
+    )
+    jmcomic_cache_budget: int = Field(default=2048, description="下载过程文件(图片等)的缓存容量上限(MB)，为0时不限制")
+    jmcomic_cache_max_age: int = Field(default=86400, description="下载过程文件的最长保留时间(秒)，为0时不限制")
+    jmcomic_cache_sweep_interval: int = Field(default=10, description="缓存清理的间隔(分钟)")
+    jmcomic_cover_concurrency: int = Field(default=10, description="同时下载的封面数量")
+    jmcomic_cover_max_size: int = Field(default=320, description="模糊封面的最长边(像素)")
+    jmcomic_cover_quality: int = Field(default=75, description="模糊封面的JPEG质量")
+    jmcomic_image_workers: int = Field(default=2, description="图片处理线程数，为0时按CPU核数")
+    jmcomic_metadata_workers: int = Field(default=8, description="查询、搜索、缓存读写等短任务的线程数")
+    jmcomic_bulk_workers: int = Field(default=4, description="下载章节、合并PDF、清理缓存等长任务的线程数")
+    jmcomic_cover_cache_ttl: int = Field(default=86400, description="模糊封面缓存的有效期(秒)，为0时不缓存")
+    jmcomic_cover_cache_memory: int = Field(default=32, description="模糊封面内存缓存容量上限(MB)")
+    jmcomic_cover_cache_disk: int = Field(default=256, description="模糊封面磁盘缓存容量上限(MB)")
+    jmcomic_metadata_cache_ttl: int = Field(default=86400, description="本子信息缓存的有效期(秒)，为0时不缓存")
+    jmcomic_metadata_negative_ttl: int = Field(default=600, description="不存在的jm号的缓存有效期(秒)")
+    jmcomic_metadata_cache_size: int = Field(default=2000, description="最多缓存的本子信息条数")
+    jmcomic_search_cache_ttl: int = Field(default=600, description="搜索结果缓存的有效期(秒)，为0时不缓存")
+    jmcomic_search_cache_size: int = Field(default=128, description="最多缓存的搜索结果页数")
+    jmcomic_http2: bool = Field(default=False, description="封面下载是否启用HTTP/2，需安装 httpx[http2]")
+    jmcomic_http_max_connections: int = Field(default=20, description="封面下载连接池的最大连接数")
+    jmcomic_http_max_keepalive: int = Field(default=10, description="封面下载连接池保持的空闲连接数")
+    jmcomic_http_keepalive_expiry: float = Field(default=30, description="空闲连接的保持时间(秒)")
+    jmcomic_cover_timeout: float = Field(default=15, description="单个图片域名下载封面的超时时间(秒)")
+    jmcomic_cover_hedge_delay: float = Field(
+        default=0, description="首选域名超过该时间(秒)未响应时同时请求次选域名，为0时不启用"
+    )
+    jmcomic_domain_failure_threshold: int = Field(default=3, description="图片域名连续失败多少次后暂停使用")
+    jmcomic_domain_cooldown: int = Field(default=300, description="失效图片域名的暂停时间(秒)")
+    jmcomic_tag_aliases: dict[str, str] = Field(default_factory=dict, description="标签别名，键为别名，值为对应的标签")
+    jmcomic_data_flush_interval: int = Field(
+        default=500, description="数据修改合并写入的间隔(毫秒)，为0时每次修改立即写入"
+    )
 
 plugin_config = get_plugin_config(Config)
 
@@ -42,18 +103,5 @@ download:
 dir_rule:
   base_dir: {cache_dir}
   rule: Bd_Pid
-
-plugins:
-  after_init:
-    - plugin: login
-      kwargs:
-        username: {plugin_config.jmcomic_username}
-        password: {plugin_config.jmcomic_password}
-
-  after_photo:
-    - plugin: img2pdf
-      kwargs:
-        pdf_dir: {cache_dir}
-        filename_rule: Pid
 """
 
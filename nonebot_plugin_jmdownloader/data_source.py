@@ -1,15 +1,47 @@
+import asyncio
+from collections.abc import Iterable
+from contextlib import contextmanager
+from datetime import date
 import json
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Any
 
 from nonebot import logger, require
 
+from .concurrency import metadata_executor
 from .config import plugin_config
+from .tag_rules import TagMatcher
 
 require("nonebot_plugin_localstore")
 from nonebot_plugin_localstore import get_plugin_data_dir
 
 
+def current_quota_period() -> int:
+    """ 返回当前是第几个下载次数周期，每周一0点开始新的周期 """
+    # 1970-01-05 是星期一
+    return (date.today() - date(1970, 1, 5)).days // 7
+
+
+def atomic_write_text(path: Path, text: str):
+    """ 先写入临时文件并落盘，再替换目标文件，避免写入中途崩溃导致文件损坏 """
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with temp_path.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
 class JmComicDataManager:
-    """ 用于管理与 JMComic 插件相关的数据 """
+    """
+    用于管理与 JMComic 插件相关的数据
+
+    数据由快照文件和追加日志组成：每次修改只向日志追加一条记录，
+    日志累积到一定条数后再合并进快照，写入量与修改量成正比。
+    在事件循环中的修改会先合并，间隔一段时间后在线程中统一写入
+    """
 
     DEFAULT_RESTRICTED_TAGS = ["獵奇", "重口", "YAOI", "yaoi", "男同", "血腥"]
     DEFAULT_RESTRICTED_IDS = [
@@ -18,47 +50,222 @@ class JmComicDataManager:
         "69658", "626487", "400002", "208092", "253199",
         "382596", "418600", "279464", "565616", "222458"
     ]
+    COMPACT_THRESHOLD = 1000
 
     def __init__(self, filename: str = "jmcomic_data.json"):
         self.filepath = get_plugin_data_dir() / filename
+        self.journal_path = self.filepath.with_suffix(".journal")
         self.data = {}
         self.default_enabled = plugin_config.jmcomic_allow_groups
+        self._pending: list[dict] = []
+        self._journal_size = 0
+        self._batch_depth = 0
+        self._flush_task: asyncio.Task | None = None
+        self._write_lock = Lock()
+        self.flush_interval = plugin_config.jmcomic_data_flush_interval
+        self.changes = 0
+        self.writes = 0
+        self.coalesced_writes = 0
+        self._rebuild_indexes()
         self._load_data()
 
         if "restricted_tags" not in self.data or not self.data["restricted_tags"]:
-            self.data["restricted_tags"] = self.DEFAULT_RESTRICTED_TAGS.copy()
+            self._record("set", ["restricted_tags"], self.DEFAULT_RESTRICTED_TAGS.copy())
 
         if "restricted_ids" not in self.data:
-            self.data["restricted_ids"] = []
+            self._record("set", ["restricted_ids"], [])
 
     def _load_data(self):
-        """ 加载数据文件 """
+        """ 加载快照文件，并重放追加日志中的修改 """
         if self.filepath.exists():
             try:
                 with self.filepath.open("r", encoding="utf-8") as f:
                     self.data = json.load(f)
                     logger.info(f"成功加载数据文件：{self.filepath}")
             except json.JSONDecodeError as e:
-                logger.error(f"数据文件读取错误：{e}")
+                # 保留损坏的文件以便手动恢复，避免被之后的写入覆盖
+                backup_path = self.filepath.with_name(f"{self.filepath.name}.corrupt")
+                os.replace(self.filepath, backup_path)
+                logger.error(f"数据文件读取错误：{e}，已备份至 {backup_path}")
                 self.data = {}
         else:
             logger.info(f"未找到数据文件，将创建新的文件：{self.filepath}")
             self.data = {}
 
-    def save(self):
-        """ 保存数据到文件 """
+        self._rebuild_indexes()
+        if self.journal_path.exists():
+            with self.journal_path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                        # 最后一行可能在写入中途中断，跳过即可
+                        logger.warning(f"跳过损坏的数据日志记录：{line.strip()}")
+            self.save()
+
+    def _rebuild_indexes(self):
+        """ 根据持久化的列表重建内存中的集合索引 """
+        self._blacklists: dict[str, set[str]] = {
+            key: set(value["blacklist"])
+            for key, value in self.data.items()
+            if isinstance(value, dict) and "blacklist" in value
+        }
+        self._restricted_ids: set[str] = set(self.data.get("restricted_ids", []))
+        self._forbidden_albums: set[str] = set(self.data.get("forbidden_albums", []))
+        self._restricted_tags: set[str] = set(self.data.get("restricted_tags", []))
+        self._tag_matcher: TagMatcher | None = None
+
+    def _index_of(self, path: list[str]) -> set[str] | None:
+        """ 返回列表对应的集合索引，没有索引时返回 None """
+        if len(path) == 1:
+            return {
+                "restricted_ids": self._restricted_ids,
+                "forbidden_albums": self._forbidden_albums,
+                "restricted_tags": self._restricted_tags,
+            }.get(path[0])
+        if len(path) == 2 and path[1] == "blacklist":
+            return self._blacklists.setdefault(path[0], set())
+        return None
+
+    def _apply(self, record: dict):
+        """ 将一条修改记录应用到内存数据并同步索引，所有操作均可重复执行 """
+        path = record["path"]
+        *parents, key = path
+        target = self.data
+        for part in parents:
+            target = target.setdefault(part, {})
+
+        op = record["op"]
+        value = record["value"]
+        if op in ("set", "delete"):
+            if op == "set":
+                target[key] = value
+            else:
+                target.pop(key, None)
+            # 整体替换列表或删除整个群的数据时重建索引
+            if self._index_of(path) is not None or (len(path) == 1 and key != "user_limits"):
+                self._rebuild_indexes()
+            return
+
+        index = self._index_of(path)
+        if op == "add":
+            items = target.setdefault(key, [])
+            if index is None:
+                if value not in items:
+                    items.append(value)
+            elif value not in index:
+                items.append(value)
+                index.add(value)
+                if index is self._restricted_tags:
+                    self._tag_matcher = None
+        elif op == "remove":
+            items = target.get(key, [])
+            if value in items:
+                items.remove(value)
+            if index is not None:
+                index.discard(value)
+                if index is self._restricted_tags:
+                    self._tag_matcher = None
+
+    def _record(self, op: str, path: list[str], value: Any = None):
+        """ 修改内存数据并标记待写入，批量修改结束前不安排写入 """
+        record = {"op": op, "path": path, "value": value}
+        self._apply(record)
+        self._pending.append(record)
+        self.changes += 1
+        if self._batch_depth == 0:
+            self._schedule_flush()
+
+    @contextmanager
+    def batch(self):
+        """ 批量修改，结束时一次性写入日志 """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._schedule_flush()
+
+    def _schedule_flush(self):
+        """ 有事件循环时延迟合并写入，否则立即写入 """
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+
         try:
-            with self.filepath.open("w", encoding="utf-8") as f:
-                json.dump(self.data, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"保存数据文件出错：{e}")
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        """ 等待一段时间收集修改，然后在线程中写入，写入期间的新修改在下一轮写入 """
+        await asyncio.sleep(self.flush_interval / 1000)
+        while self._pending:
+            await metadata_executor.run(self._write, *self._take_pending())
+
+    def _take_pending(self) -> tuple[str, str | None]:
+        """ 在事件循环中取出待写入的修改，日志过长时同时生成快照 """
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in self._pending)
+        self.writes += 1
+        self.coalesced_writes += len(self._pending) - 1
+        self._journal_size += len(self._pending)
+        self._pending.clear()
+
+        snapshot = None
+        if self._journal_size >= self.COMPACT_THRESHOLD:
+            snapshot = json.dumps(self.data, indent=4, ensure_ascii=False)
+            self._journal_size = 0
+        return lines, snapshot
+
+    def _write(self, lines: str, snapshot: str | None):
+        """ 追加日志或写入快照，快照已包含全部修改时无需再追加日志 """
+        with self._write_lock:
+            try:
+                if snapshot is not None:
+                    atomic_write_text(self.filepath, snapshot)
+                    self.journal_path.unlink(missing_ok=True)
+                else:
+                    with self.journal_path.open("a", encoding="utf-8") as f:
+                        f.write(lines)
+                        f.flush()
+                        os.fsync(f.fileno())
+            except Exception as e:
+                logger.error(f"写入数据文件出错：{e}")
+
+    def flush(self):
+        """ 立即写入所有待写入的修改 """
+        if self._pending:
+            self._write(*self._take_pending())
+
+    async def close(self):
+        """ 等待后台写入完成，并写入剩余的修改 """
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        self.flush()
+
+    def stats(self) -> str:
+        return f"修改{self.changes}次，写入{self.writes}次，合并{self.coalesced_writes}次"
+
+    def save(self):
+        """ 将全部数据原子地写入快照文件，并清空追加日志 """
+        with self._write_lock:
+            try:
+                atomic_write_text(self.filepath, json.dumps(self.data, indent=4, ensure_ascii=False))
+                self.journal_path.unlink(missing_ok=True)
+                self._journal_size = 0
+            except Exception as e:
+                logger.error(f"保存数据文件出错：{e}")
 
     # ------------------- 群文件夹 ID 管理 -------------------
     def set_group_folder_id(self, group_id: int, folder_id: str):
         """ 设置群文件夹ID """
-        group_data = self.data.setdefault(str(group_id), {})
-        group_data["folder_id"] = folder_id
-        self.save()
+        self._record("set", [str(group_id), "folder_id"], folder_id)
 
     def get_group_folder_id(self, group_id: int) -> str | None:
         """ 获取群文件夹ID """
@@ -66,16 +273,33 @@ class JmComicDataManager:
         return group_data.get("folder_id")
 
     # ------------------- 用户下载限制管理 (全局) -------------------
+    def _check_quota_period(self):
+        """
+        进入新的周期时清空所有用户的下载次数记录，未记录的用户按默认次数计算
+
+        只在读写下载次数时检查，无需定时遍历所有用户
+        """
+        period = current_quota_period()
+        stored_period = self.data.get("quota_period")
+        if stored_period == period:
+            return
+
+        with self.batch():
+            # 旧版本数据没有记录周期，沿用已有的次数
+            if stored_period is not None:
+                self._record("set", ["user_limits"], {})
+            self._record("set", ["quota_period"], period)
+
     def get_user_limit(self, user_id: int) -> int:
         """ 获取用户的当前下载次数"""
-        user_limits = self.data.setdefault("user_limits", {})
+        self._check_quota_period()
+        user_limits = self.data.get("user_limits", {})
         return user_limits.get(str(user_id), plugin_config.jmcomic_user_limits)
 
     def set_user_limit(self, user_id: int, limit: int):
         """ 设置用户的下载次数 """
-        user_limits = self.data.setdefault("user_limits", {})
-        user_limits[str(user_id)] = limit
-        self.save()
+        self._check_quota_period()
+        self._record("set", ["user_limits", str(user_id)], limit)
 
     def increase_user_limit(self, user_id: int, amount: int = 1):
         """ 增加用户的下载次数 """
@@ -91,25 +315,17 @@ class JmComicDataManager:
     # ------------------- 群黑名单管理 -------------------
     def add_blacklist(self, group_id: int, user_id: int):
         """ 添加用户到群黑名单 """
-        group_data = self.data.setdefault(str(group_id), {})
-        blacklist = group_data.setdefault("blacklist", [])
-        if str(user_id) not in blacklist:
-            blacklist.append(str(user_id))
-            self.save()
+        if not self.is_user_blacklisted(group_id, user_id):
+            self._record("add", [str(group_id), "blacklist"], str(user_id))
 
     def remove_blacklist(self, group_id: int, user_id: int):
         """ 从群黑名单移除用户 """
-        group_data = self.data.get(str(group_id), {})
-        blacklist = group_data.get("blacklist", [])
-        if str(user_id) in blacklist:
-            blacklist.remove(str(user_id))
-            self.save()
+        if self.is_user_blacklisted(group_id, user_id):
+            self._record("remove", [str(group_id), "blacklist"], str(user_id))
 
     def is_user_blacklisted(self, group_id: int, user_id: int) -> bool:
         """ 检查用户是否在群黑名单中 """
-        group_data = self.data.get(str(group_id), {})
-        blacklist = group_data.get("blacklist", [])
-        return str(user_id) in blacklist
+        return str(user_id) in self._blacklists.get(str(group_id), ())
 
     def list_blacklist(self, group_id: int) -> list[str]:
         """ 列出当前群的黑名单 """
@@ -124,9 +340,7 @@ class JmComicDataManager:
 
     def set_group_enabled(self, group_id: int, enabled: bool):
         """ 设置群功能启用或禁用 """
-        group_data = self.data.setdefault(str(group_id), {})
-        group_data["enabled"] = enabled
-        self.save()
+        self._record("set", [str(group_id), "enabled"], enabled)
 
     # ------------------- 默认禁止下载的本子管理 -------------------
     def list_forbidden_albums(self) -> list[str]:
@@ -139,57 +353,134 @@ class JmComicDataManager:
         """
         将某本子ID加入禁用列表
         """
-        forbidden = self.data.setdefault("forbidden_albums", [])
-        if album_id not in forbidden:
-            forbidden.append(album_id)
-            self.save()
+        if not self.is_forbidden_album(album_id):
+            self._record("add", ["forbidden_albums"], album_id)
 
     def remove_forbidden_album(self, album_id: str):
         """
         将某本子ID移出禁用列表
         """
-        forbidden = self.data.setdefault("forbidden_albums", [])
-        if album_id in forbidden:
-            forbidden.remove(album_id)
-            self.save()
+        if self.is_forbidden_album(album_id):
+            self._record("remove", ["forbidden_albums"], album_id)
 
     def is_forbidden_album(self, album_id: str) -> bool:
         """
         检查本子是否被禁用
         """
-        return album_id in self.data.setdefault("forbidden_albums", [])
+        return album_id in self._forbidden_albums
 
     # ------------------- 禁止下载: IDs + Tags -------------------
     def add_restricted_jm_id(self, jm_id: str):
         """ 将指定本子ID加入到禁止下载列表 """
-        restricted_ids = self.data.setdefault("restricted_ids", [])
-        if jm_id not in restricted_ids:
-            restricted_ids.append(jm_id)
-            self.save()
+        if not self.is_jm_id_restricted(jm_id):
+            self._record("add", ["restricted_ids"], jm_id)
 
     def is_jm_id_restricted(self, jm_id: str) -> bool:
         """ 检查某个本子ID是否在禁止列表中 """
-        restricted_ids = self.data.setdefault("restricted_ids", [])
-        return jm_id in restricted_ids
+        return jm_id in self._restricted_ids
 
     def add_restricted_tag(self, tag: str):
         """ 将指定标签加入到禁止下载列表 """
-        restricted_tags = self.data.setdefault("restricted_tags", [])
-        if tag not in restricted_tags:
-            restricted_tags.append(tag)
-            self.save()
+        if not self.is_tag_restricted(tag):
+            self._record("add", ["restricted_tags"], tag)
 
     def is_tag_restricted(self, tag: str) -> bool:
-        """ 检查某个标签是否在禁止列表中（忽略大小写的话可再处理） """
-        restricted_tags = self.data.setdefault("restricted_tags", [])
-        return tag in restricted_tags
+        """ 检查某个标签是否在禁止列表中 """
+        return tag in self._restricted_tags
+
+    @property
+    def tag_matcher(self) -> TagMatcher:
+        """ 禁止标签变化后，在下次使用时重新编译匹配器 """
+        if self._tag_matcher is None:
+            self._tag_matcher = TagMatcher(self._restricted_tags, plugin_config.jmcomic_tag_aliases)
+        return self._tag_matcher
 
     def has_restricted_tag(self, tags: list[str]) -> bool:
-        """ 给定一系列tags，若与 restricted_tags 有交集，则返回 True """
-        restricted_tags = set(self.data.setdefault("restricted_tags", []))
-        for t in tags:
-            if t in restricted_tags:
-                return True
-        return False
+        """ 给定一系列tags，若有标签命中禁止规则（忽略繁简、大小写，支持别名、子串和正则），则返回 True """
+        return self.tag_matcher.find(tags) is not None
+
+    def is_album_restricted(self, album_id: str, tags: list[str]) -> bool:
+        """ 检查本子ID或其标签是否被禁止 """
+        return self.is_jm_id_restricted(album_id) or self.has_restricted_tag(tags)
+
+    # ------------------- 批量导入导出 -------------------
+    def _add_many(self, key: str, values: Iterable[str]) -> list[str]:
+        """ 批量加入列表，每项写入一条记录并在结束时一次性写入，返回新加入的项 """
+        index = self._index_of([key])
+        added = [value for value in dict.fromkeys(values) if value not in index]
+        with self.batch():
+            for value in added:
+                self._record("add", [key], value)
+        return added
+
+    def _remove_many(self, key: str, values: Iterable[str]) -> list[str]:
+        """ 批量移出列表，每项写入一条记录并在结束时一次性写入，返回实际移除的项 """
+        index = self._index_of([key])
+        removing = [value for value in dict.fromkeys(values) if value in index]
+        with self.batch():
+            for value in removing:
+                self._record("remove", [key], value)
+        return removing
+
+    def add_restricted_jm_ids(self, jm_ids: Iterable[str]) -> list[str]:
+        """ 批量将本子ID加入禁止下载列表 """
+        return self._add_many("restricted_ids", jm_ids)
+
+    def remove_restricted_jm_ids(self, jm_ids: Iterable[str]) -> list[str]:
+        """ 批量将本子ID移出禁止下载列表 """
+        return self._remove_many("restricted_ids", jm_ids)
+
+    def add_restricted_tags(self, tags: Iterable[str]) -> list[str]:
+        """ 批量将标签加入禁止下载列表 """
+        return self._add_many("restricted_tags", tags)
+
+    def remove_restricted_tags(self, tags: Iterable[str]) -> list[str]:
+        """ 批量将标签移出禁止下载列表 """
+        return self._remove_many("restricted_tags", tags)
+
+    def set_user_limits(self, limits: dict[str, int]):
+        """ 批量设置用户的下载次数，每个次数有变化的用户写入一条记录，结束时一次性写入 """
+        if not limits:
+            return
+
+        self._check_quota_period()
+        user_limits = self.data.get("user_limits", {})
+        with self.batch():
+            for user_id, limit in limits.items():
+                if user_limits.get(str(user_id)) != int(limit):
+                    self._record("set", ["user_limits", str(user_id)], int(limit))
+
+    def export_data(self) -> dict[str, Any]:
+        """ 导出禁止列表和用户下载次数 """
+        return {
+            "restricted_ids": self.data.get("restricted_ids", []),
+            "restricted_tags": self.data.get("restricted_tags", []),
+            "forbidden_albums": self.data.get("forbidden_albums", []),
+            "user_limits": self.data.get("user_limits", {}),
+        }
+
+    @staticmethod
+    def _parse_import(data: dict[str, Any]) -> tuple[dict[str, list[str]], dict[str, int]]:
+        """ 校验并转换导入的数据，格式错误时抛出 TypeError 或 ValueError """
+        lists = {}
+        for key in ("restricted_ids", "restricted_tags", "forbidden_albums"):
+            values = data.get(key, [])
+            if not isinstance(values, list):
+                raise TypeError(f"{key} 应为列表")
+            lists[key] = [str(value) for value in values]
+
+        user_limits = data.get("user_limits", {})
+        if not isinstance(user_limits, dict):
+            raise TypeError("user_limits 应为对象")
+        return lists, {str(k): int(v) for k, v in user_limits.items()}
+
+    def import_data(self, data: dict[str, Any]) -> dict[str, int]:
+        """ 合并导入 export_data 格式的数据，先校验全部数据再一次写入，格式错误时不做任何修改，返回各项新增的数量 """
+        lists, user_limits = self._parse_import(data)
+        with self.batch():
+            result = {key: len(self._add_many(key, values)) for key, values in lists.items()}
+            self.set_user_limits(user_limits)
+            result["user_limits"] = len(user_limits)
+        return result
 
 data_manager = JmComicDataManager()
@@ -0,0 +1,34 @@
+from io import BytesIO
+import os
+
+from PIL import Image, ImageFilter
+
+from .concurrency import BoundedExecutor
+from .config import plugin_config
+
+
+def blur_thumbnail(data: bytes, max_size: int, radius: float, quality: int) -> bytes:
+    """
+    将封面缩小到 max_size 以内后再模糊
+
+    JPEG 在解码阶段直接按比例缩小，模糊半径随缩放比例调整，保证观感与原图模糊一致
+    """
+    image = Image.open(BytesIO(data))
+    original_width = image.width
+
+    # 仅对 JPEG 生效，解码时直接以 1/2、1/4、1/8 缩小
+    image.draft("RGB", (max_size, max_size))
+    image = image.convert("RGB")
+    image.thumbnail((max_size, max_size), reducing_gap=2.0)
+
+    scale = image.width / original_width
+    blurred = image.filter(ImageFilter.GaussianBlur(radius=max(1.0, radius * scale)))
+
+    output = BytesIO()
+    blurred.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+# Pillow 在缩放、模糊和编码时释放 GIL，线程池即可利用多核。
+# 不使用进程池：fork 会复制持有锁的多线程进程，spawn/forkserver 则要在子进程中重新导入插件
+image_worker = BoundedExecutor("图片处理", plugin_config.jmcomic_image_workers or (os.cpu_count() or 1))
@@ -0,0 +1,195 @@
+import asyncio
+from dataclasses import dataclass
+from importlib.util import find_spec
+import time
+
+import httpx
+from jmcomic import JmModuleConfig
+from nonebot import logger
+
+from .config import plugin_config
+
+
+class HttpClientManager:
+    """ 插件共享的 httpx 连接池，随 Bot 启动创建、关闭时释放 """
+
+    def __init__(self):
+        self._client: httpx.AsyncClient | None = None
+        self.requests = 0
+        self.new_connections = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    @property
+    def reused_connections(self) -> int:
+        return max(0, self.requests - self.new_connections)
+
+    @staticmethod
+    def _build_client() -> httpx.AsyncClient:
+        http2 = plugin_config.jmcomic_http2
+        if http2 and find_spec("h2") is None:
+            logger.warning("未安装 h2，封面下载将使用 HTTP/1.1，可通过 pip install httpx[http2] 启用 HTTP/2")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=plugin_config.jmcomic_http_max_connections,
+            max_keepalive_connections=plugin_config.jmcomic_http_max_keepalive,
+            keepalive_expiry=plugin_config.jmcomic_http_keepalive_expiry,
+        )
+        return httpx.AsyncClient(http2=http2, limits=limits)
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """ 使用共享连接池发送 GET 请求 """
+        self.requests += 1
+        return await self.client.get(url, extensions={"trace": self._trace}, **kwargs)
+
+    async def startup(self):
+        self._client = self._build_client()
+
+    async def shutdown(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        logger.info(f"封面连接池已关闭：{self.stats()}")
+
+    def stats(self) -> str:
+        return f"请求{self.requests}次，新建连接{self.new_connections}个，复用连接{self.reused_connections}次"
+
+
+@dataclass
+class DomainStat:
+    latency: float | None = None
+    failures: int = 0
+    successes: int = 0
+    open_until: float = 0.0
+
+
+class DomainHealth:
+    """ 记录各图片域名的延迟与失败次数，按近期表现排序，并熔断连续失败的域名 """
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.stats: dict[str, DomainStat] = {}
+
+    def record_success(self, domain: str, latency: float):
+        stat = self.stats.setdefault(domain, DomainStat())
+        # 指数加权平均，偏向近期的延迟
+        stat.latency = latency if stat.latency is None else stat.latency * 0.7 + latency * 0.3
+        stat.failures = 0
+        stat.successes += 1
+        stat.open_until = 0.0
+
+    def record_failure(self, domain: str):
+        stat = self.stats.setdefault(domain, DomainStat())
+        stat.failures += 1
+        if stat.failures >= self.failure_threshold:
+            stat.open_until = time.monotonic() + self.cooldown
+            logger.warning(f"图片域名 {domain} 连续失败{stat.failures}次，暂停使用{self.cooldown:.0f}秒")
+
+    def is_open(self, domain: str) -> bool:
+        stat = self.stats.get(domain)
+        return stat is not None and stat.open_until > time.monotonic()
+
+    def rank(self, domains: list[str]) -> list[str]:
+        """ 可用域名按失败次数、延迟排序在前，尚未测得延迟的域名排在已知可用的域名之后，熔断中的域名排在最后兜底 """
+        def key(domain: str):
+            stat = self.stats.get(domain, DomainStat())
+            latency = stat.latency if stat.latency is not None else float("inf")
+            broken = self.is_open(domain)
+            return (broken, stat.open_until if broken else 0.0, stat.failures, latency)
+
+        return sorted(domains, key=key)
+
+    def summary(self) -> str:
+        lines = []
+        for domain, stat in self.stats.items():
+            latency = f"{stat.latency * 1000:.0f}ms" if stat.latency is not None else "-"
+            state = "熔断" if self.is_open(domain) else "正常"
+            lines.append(f"{domain}：{state}，延迟{latency}，成功{stat.successes}次，连续失败{stat.failures}次")
+        return "\n".join(lines) or "暂无记录"
+
+
+http_client = HttpClientManager()
+domain_health = DomainHealth(plugin_config.jmcomic_domain_failure_threshold, plugin_config.jmcomic_domain_cooldown)
+
+
+async def _get_from_domain(domain: str, path: str) -> httpx.Response | None:
+    """
+    请求单个图片域名并记录其健康状况，失败时返回 None
+
+    只有连接错误和 5xx 计入域名失败；404 说明资源本身不存在，原样返回由调用方处理
+    """
+    start = time.monotonic()
+    try:
+        response = await http_client.get(f"https://{domain}{path}", timeout=plugin_config.jmcomic_cover_timeout)
+    except httpx.RequestError:
+        domain_health.record_failure(domain)
+        return None
+
+    if response.is_server_error:
+        domain_health.record_failure(domain)
+        return None
+
+    domain_health.record_success(domain, time.monotonic() - start)
+    if response.is_success or response.status_code == httpx.codes.NOT_FOUND:
+        return response
+    return None
+
+
+async def _hedged_get(domains: list[str], path: str, delay: float) -> tuple[httpx.Response | None, int]:
+    """
+    先请求第一个域名，超过 delay 秒未返回时同时请求第二个域名，取先成功的结果
+
+    返回响应和已尝试的域名数
+    """
+    tasks = [asyncio.create_task(_get_from_domain(domains[0], path))]
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+    if not done:
+        tasks.append(asyncio.create_task(_get_from_domain(domains[1], path)))
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            response = await next_done
+            if response is not None:
+                return response, len(tasks)
+        return None, len(tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _found(response: httpx.Response, path: str) -> httpx.Response | None:
+    """ 资源不存在时返回 None，例如没有封面的章节 """
+    if response.status_code == httpx.codes.NOT_FOUND:
+        logger.debug(f"{path} 不存在")
+        return None
+    return response
+
+
+async def get_from_image_domains(path: str) -> httpx.Response | None:
+    """ 按健康度依次尝试 JM 图片域名，返回第一个成功的响应，资源不存在(404)时不再尝试其余域名 """
+    domains = domain_health.rank(list(JmModuleConfig.DOMAIN_IMAGE_LIST))
+    hedge_delay = plugin_config.jmcomic_cover_hedge_delay
+
+    if hedge_delay > 0 and len(domains) >= 2:
+        response, tried = await _hedged_get(domains, path, hedge_delay)
+        if response is not None:
+            return _found(response, path)
+        domains = domains[tried:]
+
+    for domain in domains:
+        response = await _get_from_domain(domain, path)
+        if response is not None:
+            return _found(response, path)
+
+    logger.warning(f"{path} 下载失败：所有域名不可用")
+    return None
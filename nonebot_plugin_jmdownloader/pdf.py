@@ -0,0 +1,514 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+import hashlib
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+import time
+from typing import ClassVar
+
+from jmcomic import JmcomicClient, JmDownloader, JmImageDetail, JmOption, JmPhotoDetail
+from nonebot import logger
+from PIL import Image
+
+JPEG_MAGIC = b"\xff\xd8"
+# 与 img2pdf 一致，图片没有 DPI 信息时按 96 DPI 计算页面尺寸
+DEFAULT_DPI = 96
+
+
+def _pdf_text(text: str) -> bytes:
+    """ 转为 UTF-16BE 编码的 PDF 字符串，用于标题等元数据 """
+    return b"<" + ("\ufeff" + text).encode("utf-16-be").hex().upper().encode() + b">"
+
+
+def _read_jpeg(path: Path) -> tuple[bytes, int, int, str]:
+    """
+    读取图片并返回 (JPEG 数据, 宽, 高, 颜色模式)
+
+    JPEG 文件直接使用原始数据，不重新编码；其他格式转为 JPEG
+    """
+    data = path.read_bytes()
+    with Image.open(BytesIO(data)) as image:
+        if data.startswith(JPEG_MAGIC) and image.mode in ("L", "RGB"):
+            return data, image.width, image.height, image.mode
+
+        output = BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=95)
+        return output.getvalue(), image.width, image.height, "RGB"
+
+
+@dataclass
+class ImageProfile:
+    """ 打包前的图片压缩配置：最长边、JPEG 质量和是否转为灰度，均为默认值时不处理 """
+
+    max_size: int = 0
+    quality: int = 0
+    grayscale: bool = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 or self.quality > 0 or self.grayscale
+
+    def apply(self, path: Path) -> tuple[int, int]:
+        """ 压缩图片并覆盖原文件，返回压缩前后的大小，压缩后反而更大时保留原图 """
+        data = path.read_bytes()
+        mode = "L" if self.grayscale else "RGB"
+
+        with Image.open(BytesIO(data)) as image:
+            if self.max_size > 0:
+                # JPEG 在解码阶段直接按比例缩小
+                image.draft(mode, (self.max_size, self.max_size))
+            image = image.convert(mode)
+            if self.max_size > 0:
+                image.thumbnail((self.max_size, self.max_size), reducing_gap=2.0)
+
+            output = BytesIO()
+            image.save(output, format="JPEG", quality=self.quality or 85, optimize=True)
+
+        compressed = output.getvalue()
+        if len(compressed) >= len(data):
+            return len(data), len(data)
+
+        temp_path = path.with_name(f"{path.name}.tmp")
+        temp_path.write_bytes(compressed)
+        os.replace(temp_path, path)
+        return len(data), len(compressed)
+
+
+class PdfFile:
+    """ 逐页追加写入的 PDF 文件，写入过程中使用临时文件，关闭时替换为正式文件 """
+
+    COLOR_SPACES: ClassVar[dict[str, bytes]] = {"L": b"/DeviceGray", "RGB": b"/DeviceRGB"}
+
+    def __init__(self, output: Path, title: str | None = None):
+        self.output = output
+        self.title = title
+        self.temp_path = output.with_name(f"{output.name}.part")
+
+        # 对象号 1、2 预留给 Catalog 和 Pages，最后写入
+        self._offsets: dict[int, int] = {}
+        self._next_obj = 3
+        self._page_objs: list[int] = []
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.temp_path.open("wb")
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_objs)
+
+    @property
+    def size(self) -> int:
+        return self._file.tell()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def _write_obj(self, body: bytes, obj: int | None = None) -> int:
+        """ 写入一个对象并记录偏移量，返回对象号 """
+        if obj is None:
+            obj = self._next_obj
+            self._next_obj += 1
+
+        self._offsets[obj] = self._file.tell()
+        self._file.write(b"%d 0 obj\n%s\nendobj\n" % (obj, body))
+        return obj
+
+    def _write_stream(self, attrs: bytes, data: bytes) -> int:
+        """ 写入一个流对象，attrs 为字典中除 /Length 外的内容 """
+        obj = self._next_obj
+        self._next_obj += 1
+
+        self._offsets[obj] = self._file.tell()
+        self._file.write(b"%d 0 obj\n<< %s /Length %d >>\nstream\n" % (obj, attrs, len(data)))
+        self._file.write(data)
+        self._file.write(b"\nendstream\nendobj\n")
+        return obj
+
+    def add_page(self, data: bytes, width: int, height: int, mode: str):
+        """ 以 JPEG 数据添加一页 """
+        image_obj = self._write_stream(
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s"
+            b" /BitsPerComponent 8 /Filter /DCTDecode" % (width, height, self.COLOR_SPACES[mode]),
+            data,
+        )
+
+        page_width = width * 72 / DEFAULT_DPI
+        page_height = height * 72 / DEFAULT_DPI
+        content_obj = self._write_stream(b"", b"q %.4f 0 0 %.4f 0 0 cm /Im0 Do Q" % (page_width, page_height))
+
+        self._page_objs.append(self._write_obj(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f]"
+            b" /Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+            % (page_width, page_height, image_obj, content_obj)
+        ))
+
+    def close(self) -> Path:
+        """ 写入页面树、交叉引用表和文件尾，返回正式文件路径 """
+        kids = b" ".join(b"%d 0 R" % obj for obj in self._page_objs)
+        self._write_obj(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_objs)), obj=2)
+        self._write_obj(b"<< /Type /Catalog /Pages 2 0 R >>", obj=1)
+        trailer = b"/Root 1 0 R"
+        if self.title:
+            info_obj = self._write_obj(b"<< /Title %s >>" % _pdf_text(self.title))
+            trailer += b" /Info %d 0 R" % info_obj
+
+        xref_offset = self._file.tell()
+        size = self._next_obj
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        self._file.write(b"".join(b"%010d 00000 n \n" % self._offsets[obj] for obj in range(1, size)))
+        self._file.write(b"trailer\n<< /Size %d %s >>\nstartxref\n%d\n%%%%EOF\n" % (size, trailer, xref_offset))
+        self._file.close()
+
+        os.replace(self.temp_path, self.output)
+        return self.output
+
+    def abort(self):
+        """ 放弃写入，删除临时文件 """
+        self._file.close()
+        self.temp_path.unlink(missing_ok=True)
+
+
+class StreamingPdfWriter:
+    """
+    边下载边生成 PDF
+
+    每张图片下载完成后，按页码顺序写入已就绪的连续页；乱序完成的页只记录页码，
+    等前面的页完成后再写入。任意时刻只在内存中保留一页图片，与总页数无关。
+    设置了分卷页数或大小时，当前分卷写满后关闭并开始下一卷
+    """
+
+    def __init__(
+        self,
+        output: Path,
+        page_paths: list[Path],
+        title: str | None = None,
+        volume_pages: int = 0,
+        volume_size: int = 0,
+    ):
+        self.output = output
+        self.page_paths = page_paths
+        self.title = title
+        self.volume_pages = volume_pages
+        self.volume_size = volume_size
+
+        self._lock = Lock()
+        self._ready: set[int] = set()
+        self._next_page = 0
+        self._volumes: list[Path] = []
+        self._current = PdfFile(self._volume_path(1) if self.split else output, title)
+
+    @property
+    def split(self) -> bool:
+        return self.volume_pages > 0 or self.volume_size > 0
+
+    @property
+    def pages_written(self) -> int:
+        return self._next_page
+
+    def _volume_path(self, number: int) -> Path:
+        return self.output.with_name(f"{self.output.stem}_part{number}{self.output.suffix}")
+
+    def _volume_full(self, next_page_size: int) -> bool:
+        """ 当前分卷再加入下一页是否会超出限制，每卷至少一页 """
+        current = self._current
+        if not self.split or current.page_count == 0:
+            return False
+        if self.volume_pages > 0 and current.page_count >= self.volume_pages:
+            return True
+        return self.volume_size > 0 and current.size + next_page_size > self.volume_size
+
+    def _write_ready(self):
+        while self._next_page in self._ready:
+            self._ready.discard(self._next_page)
+            data, width, height, mode = _read_jpeg(self.page_paths[self._next_page])
+
+            if self._volume_full(len(data)):
+                self._volumes.append(self._current.close())
+                self._current = PdfFile(self._volume_path(len(self._volumes) + 1), self.title)
+
+            self._current.add_page(data, width, height, mode)
+            self._next_page += 1
+
+    def page_done(self, index: int):
+        """ 标记第 index 页(从0开始)已下载完成，可在任意线程调用 """
+        with self._lock:
+            if self._current.closed:
+                return
+            self._ready.add(index)
+            self._write_ready()
+
+    def finish(self) -> list[Path]:
+        """ 写入剩余的页并关闭文件，返回按顺序排列的各卷路径 """
+        with self._lock:
+            # 命中图片缓存的页不会触发下载完成回调，在这里补上
+            self._ready.update(
+                index for index in range(self._next_page, len(self.page_paths))
+                if self.page_paths[index].exists()
+            )
+            self._write_ready()
+            if self._next_page < len(self.page_paths):
+                raise FileNotFoundError(f"缺少第{self._next_page + 1}页图片：{self.page_paths[self._next_page]}")
+
+            self._volumes.append(self._current.close())
+
+        # 只有一卷时不加分卷后缀
+        if len(self._volumes) == 1 and self._volumes[0] != self.output:
+            os.replace(self._volumes[0], self.output)
+            self._volumes[0] = self.output
+        return self._volumes
+
+    def abort(self):
+        """ 放弃生成，删除未完成和已完成的分卷 """
+        with self._lock:
+            self._current.abort()
+        for path in self._volumes:
+            path.unlink(missing_ok=True)
+
+
+class JobManifest:
+    """
+    章节下载清单：记录已下载完成并校验过的图片(文件大小和 MD5)
+
+    下载中断后图片目录会保留到被缓存清理为止，重试或其他人再次下载同一章节时，
+    只有清单中记录且校验通过的图片会被复用，其余图片(包括写入一半的文件)重新下载
+    """
+
+    FILENAME = ".manifest.json"
+    # 每记录这么多张图片保存一次清单
+    SAVE_EVERY = 20
+
+    def __init__(self, photo_dir: Path, version: str):
+        self.path = photo_dir / self.FILENAME
+        self.version = version
+        self.pages: dict[str, list] = {}
+        # 本次下载开始时校验通过、可以直接复用的图片
+        self.reusable: set[str] = set()
+        self._lock = Lock()
+        self._unsaved = 0
+
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        # 章节内容有更新时旧记录作废
+        if isinstance(data, dict) and data.get("version") == version:
+            self.pages = data.get("pages", {})
+
+    @staticmethod
+    def digest(path: Path) -> list:
+        data = path.read_bytes()
+        return [len(data), hashlib.md5(data).hexdigest()]
+
+    def verified(self, path: Path) -> bool:
+        """ 图片是否已下载完成且与清单记录一致 """
+        entry = self.pages.get(path.name)
+        if entry is None:
+            return False
+        try:
+            return path.stat().st_size == entry[0] and self.digest(path) == entry
+        except OSError:
+            return False
+
+    def check(self, paths: list[Path]) -> int:
+        """ 校验已有的图片，返回可以复用的数量 """
+        self.reusable = {path.name for path in paths if self.verified(path)}
+        return len(self.reusable)
+
+    def record(self, path: Path):
+        """ 记录一张下载完成的图片，由各下载线程调用 """
+        entry = self.digest(path)
+        with self._lock:
+            self.pages[path.name] = entry
+            self._unsaved += 1
+            if self._unsaved < self.SAVE_EVERY:
+                return
+        self.save()
+
+    def save(self):
+        with self._lock:
+            if not self._unsaved:
+                return
+            text = json.dumps({"version": self.version, "pages": self.pages})
+            self._unsaved = 0
+
+        temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            temp_path.write_text(text, encoding="utf-8")
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"下载清单保存失败：{e}")
+
+
+class PdfDownloader(JmDownloader):
+    """
+    图片下载完成后立即写入 PDF 的下载器，下载结束时 PDF 也随即生成
+
+    配置了图片压缩时，在各下载线程中先压缩再写入，压缩与下载、写入并行进行。
+    生成的各卷路径保存在 outputs 中，由调用方取出。
+    每张图片失败后按指数退避单独重试，已完成的图片记录在 JobManifest 中供下次下载复用。
+    设置了 image_threads 时，所有同时进行的章节共享这些图片下载名额。
+    version_of 计算章节的版本号，章节更新后清单作废；未提供时不区分版本
+    """
+
+    def __init__(
+        self,
+        option: JmOption,
+        pdf_dir: Path,
+        profile: ImageProfile | None = None,
+        volume_pages: int = 0,
+        volume_size: int = 0,
+        page_retries: int = 0,
+        retry_delay: float = 1.0,
+        image_threads: int = 0,
+        version_of: Callable[[JmPhotoDetail], str] | None = None,
+    ):
+        super().__init__(option)
+        self.pdf_dir = pdf_dir
+        self.profile = profile or ImageProfile()
+        self.volume_pages = volume_pages
+        self.volume_size = volume_size
+        self.outputs: dict[str, list[Path]] = {}
+        self._writers: dict[str, StreamingPdfWriter] = {}
+        self._sizes: dict[str, list[int]] = {}
+        self._sizes_lock = Lock()
+        self._manifests: dict[str, JobManifest] = {}
+        self.page_retries = page_retries
+        self.retry_delay = retry_delay
+        self._image_slots = BoundedSemaphore(image_threads) if image_threads > 0 else None
+        self.version_of = version_of
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.pages_reused = 0
+        self.pages_retried = 0
+
+    def before_photo(self, photo: JmPhotoDetail):
+        super().before_photo(photo)
+        page_paths = [Path(self.option.decide_image_filepath(image)) for image in photo]
+        self._writers[photo.photo_id] = StreamingPdfWriter(
+            self.pdf_dir / f"{photo.photo_id}.pdf",
+            page_paths,
+            title=photo.title,
+            volume_pages=self.volume_pages,
+            volume_size=self.volume_size,
+        )
+        self._sizes[photo.photo_id] = [0, 0]
+
+        version = self.version_of(photo) if self.version_of is not None else ""
+        manifest = JobManifest(Path(self.option.decide_image_save_dir(photo)), version)
+        self._manifests[photo.photo_id] = manifest
+        if reused := manifest.check(page_paths):
+            self.pages_reused += reused
+            logger.info(f"jm{photo.photo_id} 继续上次的下载，复用{reused}/{len(page_paths)}张图片")
+
+    def before_image(self, image: JmImageDetail, img_save_path):
+        super().before_image(image, img_save_path)
+        manifest = self._manifests.get(image.from_photo.photo_id)
+        if manifest is None or not image.exists:
+            return
+
+        # 不在清单中的文件可能只写入了一半，删除后重新下载
+        path = Path(img_save_path)
+        if path.name not in manifest.reusable:
+            path.unlink(missing_ok=True)
+            image.exists = False
+
+    def download_by_image_detail(self, image: JmImageDetail, client: JmcomicClient):
+        for attempt in range(self.page_retries + 1):
+            try:
+                if self._image_slots is None:
+                    return super().download_by_image_detail(image, client)
+                with self._image_slots:
+                    return super().download_by_image_detail(image, client)
+            except Exception as e:
+                if attempt >= self.page_retries:
+                    # 删除可能只写入一半的文件，生成 PDF 时按缺页报错
+                    if image.save_path:
+                        Path(image.save_path).unlink(missing_ok=True)
+                    raise
+                # 重试成功时不再保留这次失败记录
+                failure = next((item for item in self.download_failed_list if item[0] is image), None)
+                if failure is not None:
+                    self.download_failed_list.remove(failure)
+
+                delay = min(self.retry_delay * 2 ** attempt, 30)
+                logger.warning(f"第{image.index}页下载失败，{delay:.0f}秒后重试：{e}")
+                with self._sizes_lock:
+                    self.pages_retried += 1
+                time.sleep(delay)
+
+    def after_image(self, image: JmImageDetail, img_save_path):
+        super().after_image(image, img_save_path)
+        photo_id = image.from_photo.photo_id
+
+        if self.profile.enabled:
+            before, after = self.profile.apply(Path(img_save_path))
+            with self._sizes_lock:
+                sizes = self._sizes.get(photo_id)
+                if sizes is not None:
+                    sizes[0] += before
+                    sizes[1] += after
+
+        manifest = self._manifests.get(photo_id)
+        if manifest is not None:
+            manifest.record(Path(img_save_path))
+
+        writer = self._writers.get(photo_id)
+        if writer is not None:
+            writer.page_done(image.index - 1)
+
+    def after_photo(self, photo: JmPhotoDetail):
+        super().after_photo(photo)
+        self._manifests[photo.photo_id].save()
+        self.outputs[photo.photo_id] = self._writers[photo.photo_id].finish()
+        del self._writers[photo.photo_id]
+
+        before, after = self._sizes.pop(photo.photo_id)
+        if before:
+            with self._sizes_lock:
+                self.bytes_before += before
+                self.bytes_after += after
+            logger.info(f"jm{photo.photo_id} 图片压缩：{before / 1048576:.1f}MB → {after / 1048576:.1f}MB")
+
+    def merge(self, photos: list[JmPhotoDetail], output: Path, title: str) -> list[Path]:
+        """ 将已下载的多个章节的图片按顺序写入同一个 PDF，按配置分卷，返回各卷路径 """
+        page_paths = [Path(self.option.decide_image_filepath(image)) for photo in photos for image in photo]
+        writer = StreamingPdfWriter(
+            output,
+            page_paths,
+            title=title,
+            volume_pages=self.volume_pages,
+            volume_size=self.volume_size,
+        )
+        try:
+            return writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def stats(self) -> str:
+        if not self.bytes_before:
+            return "未压缩" if not self.profile.enabled else "暂无记录"
+        ratio = self.bytes_after / self.bytes_before * 100
+        return f"{self.bytes_before / 1048576:.1f}MB → {self.bytes_after / 1048576:.1f}MB ({ratio:.0f}%)"
+
+    def resume_stats(self) -> str:
+        return f"复用{self.pages_reused}张图片，重试{self.pages_retried}次"
+
+    def download_by_photo_detail(self, photo: JmPhotoDetail, client: JmcomicClient):
+        try:
+            super().download_by_photo_detail(photo, client)
+        finally:
+            # 下载失败或被跳过时清理未完成的 PDF
+            writer = self._writers.pop(photo.photo_id, None)
+            if writer is not None:
+                writer.abort()
+            self._sizes.pop(photo.photo_id, None)
+            # 保留已完成图片的记录，下次下载时只下载缺少的图片
+            manifest = self._manifests.pop(photo.photo_id, None)
+            if manifest is not None:
+                manifest.save()
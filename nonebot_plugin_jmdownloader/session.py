@@ -0,0 +1,255 @@
+import asyncio
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+import time
+from typing import Any, ClassVar
+
+from jmcomic import (
+    JmcomicClient,
+    JmcomicException,
+    JmModuleConfig,
+    JmOption,
+    MissingAlbumPhotoException,
+    create_option_by_str,
+)
+from nonebot import logger
+
+from .concurrency import metadata_executor
+from .config import config_data, plugin_config
+
+
+class JmSession:
+    """
+    一个 jmcomic 客户端及其登录状态
+
+    在后台创建客户端并登录，失败时按指数退避不断重试，不阻塞启动。
+    重新登录时，新客户端登录成功前继续使用旧客户端
+    """
+
+    MAX_RETRY_DELAY = 300
+
+    def __init__(self, name: str, option: JmOption, username: str, password: str, primary: bool, ready: asyncio.Event):
+        self.name = name
+        self.option = option
+        self.username = username
+        self.password = password
+        self.primary = primary
+        self.client: JmcomicClient | None = None
+        self.last_error: str | None = None
+        self.logged_in_at: float | None = None
+        # 以下由客户端池在各线程中更新
+        self.in_flight = 0
+        self.failures = 0
+        self.evicted = False
+        self._ready = ready
+        self._task: asyncio.Task | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None and not self.evicted
+
+    @property
+    def logging_in(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _connect(self) -> JmcomicClient:
+        """ 创建新的客户端并登录，在线程中执行 """
+        client = self.option.new_jm_client()
+        client.login(self.username, self.password)
+
+        # 与 jmcomic 的 login 插件相同，主账号登录后的 cookies 作为默认 cookies
+        if self.primary:
+            cookies = dict(client["cookies"])
+            self.option.update_cookies(cookies)
+            JmModuleConfig.APP_COOKIES = cookies
+        return client
+
+    async def _login(self):
+        attempt = 0
+        while True:
+            delay = min(2 ** attempt, self.MAX_RETRY_DELAY)
+            try:
+                client = await metadata_executor.run(self._connect)
+            except (JmcomicException, OSError) as e:
+                self.last_error = str(e)
+                logger.warning(f"JMComic 会话 {self.name} 登录失败，{delay}秒后重试：{e}")
+            except Exception as e:
+                # 后台任务中未处理的异常会使会话一直停留在登录中，同样退避重试
+                self.last_error = repr(e)
+                logger.exception(f"JMComic 会话 {self.name} 登录时发生意外错误，{delay}秒后重试")
+            else:
+                break
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        self.client = client
+        self.last_error = None
+        self.logged_in_at = time.time()
+        self.failures = 0
+        self.evicted = False
+        self._ready.set()
+        logger.info(f"JMComic 会话 {self.name} 登录成功")
+
+    def start(self):
+        """ 在后台登录，已经在登录时不重复启动 """
+        if not self.logging_in:
+            self._task = asyncio.create_task(self._login())
+
+    def stop(self):
+        if self.logging_in:
+            self._task.cancel()
+
+    def stats(self) -> str:
+        if self.client is None:
+            return f"登录中（{self.last_error}）" if self.last_error else "登录中"
+
+        if self.evicted:
+            status = "已停用，正在重新登录"
+        else:
+            status = f"已登录（{datetime.fromtimestamp(self.logged_in_at):%m-%d %H:%M}），进行中{self.in_flight}个请求"
+            if self.logging_in:
+                status += "，正在重新登录"
+        return status
+
+
+class PooledClient:
+    """ 替代单个客户端使用，每次调用分派给池中进行中请求最少的会话 """
+
+    # 图片从 CDN 下载，失败与会话本身无关，不计入会话的健康状态
+    UNTRACKED: ClassVar[set[str]] = {"download_by_image_detail", "download_image"}
+
+    def __init__(self, pool: "ClientPool"):
+        self._pool = pool
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        # 只分派客户端的方法，其余属性直接从任一会话的客户端读取
+        if not callable(getattr(JmcomicClient, name, None)):
+            with self._pool.lease(track=False) as client:
+                return getattr(client, name)
+
+        def call(*args, **kwargs):
+            with self._pool.lease(track=name not in self.UNTRACKED) as client:
+                return getattr(client, name)(*args, **kwargs)
+
+        return call
+
+
+class ClientPool:
+    """
+    jmcomic 客户端池，可由多个账号、每个账号多个会话组成
+
+    每次请求交给进行中请求最少的可用会话；会话连续失败达到阈值时停用并在后台重新登录，
+    登录成功后重新加入。所有会话都不可用时仍使用已登录的会话，避免全部请求直接失败
+    """
+
+    def __init__(self, option: JmOption, accounts: dict[str, str], sessions_per_account: int, failure_threshold: int):
+        self.failure_threshold = max(1, failure_threshold)
+        self._ready = asyncio.Event()
+        self._lock = Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.sessions = [
+            JmSession(
+                f"{username}#{number}" if sessions_per_account > 1 else username,
+                option, username, password,
+                primary=index == 0 and number == 1,
+                ready=self._ready,
+            )
+            for index, (username, password) in enumerate(accounts.items())
+            for number in range(1, max(1, sessions_per_account) + 1)
+        ]
+        self.client = PooledClient(self)
+
+    @property
+    def ready(self) -> bool:
+        return any(session.client is not None for session in self.sessions)
+
+    def _pick(self) -> JmSession:
+        with self._lock:
+            candidates = [session for session in self.sessions if session.available]
+            if not candidates:
+                candidates = [session for session in self.sessions if session.client is not None]
+            if not candidates:
+                raise JmcomicException("没有已登录的 JMComic 会话", {})
+
+            session = min(candidates, key=lambda s: (s.in_flight, s.failures))
+            session.in_flight += 1
+            return session
+
+    @contextmanager
+    def lease(self, track: bool = True) -> Iterator[JmcomicClient]:
+        """ 借出一个会话的客户端，可在任意线程调用，结束后记录请求结果 """
+        session = self._pick()
+        try:
+            yield session.client
+        except MissingAlbumPhotoException:
+            # 本子不存在是正常的查询结果
+            self._record(session, True, track)
+            raise
+        except (JmcomicException, OSError):
+            self._record(session, False, track)
+            raise
+        else:
+            self._record(session, True, track)
+        finally:
+            with self._lock:
+                session.in_flight -= 1
+
+    def _record(self, session: JmSession, ok: bool, track: bool):
+        if not track:
+            return
+
+        with self._lock:
+            if ok:
+                session.failures = 0
+                return
+            session.failures += 1
+            if session.evicted or session.failures < self.failure_threshold:
+                return
+            session.evicted = True
+
+        logger.warning(f"JMComic 会话 {session.name} 连续失败{session.failures}次，暂时停用并重新登录")
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(session.start)
+
+    async def get_client(self, timeout: float) -> PooledClient | None:
+        """ 返回客户端池，还没有会话登录成功时开始登录并最多等待 timeout 秒 """
+        if self.ready:
+            return self.client
+
+        await self.startup()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.client
+
+    async def startup(self):
+        self._loop = asyncio.get_running_loop()
+        for session in self.sessions:
+            session.start()
+
+    async def refresh(self):
+        """ 定时重新登录所有会话，避免登录状态过期 """
+        await self.startup()
+
+    async def shutdown(self):
+        for session in self.sessions:
+            session.stop()
+
+    def stats(self) -> str:
+        return "\n".join(f"{session.name}：{session.stats()}" for session in self.sessions)
+
+
+option = create_option_by_str(config_data, mode="yml")
+jm_pool = ClientPool(
+    option,
+    {plugin_config.jmcomic_username: plugin_config.jmcomic_password, **plugin_config.jmcomic_extra_accounts},
+    plugin_config.jmcomic_sessions_per_account,
+    plugin_config.jmcomic_session_failure_threshold,
+)
@@ -0,0 +1,96 @@
+from collections.abc import Iterable
+from functools import lru_cache
+import re
+
+from nonebot import logger
+
+try:
+    from opencc import OpenCC
+except ImportError:
+    OpenCC = None
+
+REGEX_PREFIX = "re:"
+
+# 未安装 opencc 时使用的繁简对照表，只覆盖本子标签中的常见字
+_T2S_TABLE = str.maketrans({
+    "獵": "猎", "無": "无", "觸": "触", "蟲": "虫", "糞": "粪", "懷": "怀", "強": "强", "姦": "奸", "變": "变",
+    "態": "态", "兒": "儿", "媽": "妈", "婦": "妇", "頭": "头", "腦": "脑", "體": "体", "獸": "兽", "殘": "残",
+    "殺": "杀", "屍": "尸", "亂": "乱", "倫": "伦", "學": "学", "師": "师", "醫": "医", "護": "护", "偽": "伪",
+    "蘿": "萝", "髮": "发", "絲": "丝", "襪": "袜", "腳": "脚", "縛": "缚", "綁": "绑", "脅": "胁", "調": "调",
+    "監": "监", "醜": "丑", "異": "异", "種": "种", "機": "机", "鬥": "斗", "戰": "战", "獄": "狱", "邊": "边",
+    "緣": "缘", "號": "号", "獨": "独", "惡": "恶", "龍": "龙", "貓": "猫", "們": "们", "單": "单", "劇": "剧",
+    "畫": "画", "漢": "汉", "譯": "译", "語": "语", "韓": "韩", "國": "国", "華": "华", "長": "长", "門": "门",
+    "開": "开", "關": "关", "見": "见", "後": "后", "樂": "乐", "歲": "岁", "點": "点", "專": "专", "愛": "爱",
+    "戀": "恋", "傷": "伤", "淚": "泪",
+})
+
+
+def _build_converter():
+    if OpenCC is None:
+        return None
+    try:
+        return OpenCC("t2s")
+    except Exception as e:
+        logger.warning(f"opencc 初始化失败，使用内置繁简对照表：{e}")
+        return None
+
+
+_converter = _build_converter()
+
+
+def _simplify(text: str) -> str:
+    """ 去除空白并转为简体 """
+    text = "".join(text.split())
+    return _converter.convert(text) if _converter is not None else text.translate(_T2S_TABLE)
+
+
+@lru_cache(maxsize=4096)
+def normalize_tag(tag: str) -> str:
+    """ 将标签统一为简体、忽略大小写并去除空白 """
+    return _simplify(tag).casefold()
+
+
+class TagMatcher:
+    """
+    由禁止标签编译出的匹配器
+
+    普通规则匹配标准化后标签中的子串，以 re: 开头的规则按正则表达式匹配。
+    标签标准化时去除了空白并转为简体，正则规则同样去除空白并转为简体后再编译，
+    不做大小写转换(以免改变 \\S、\\W 等转义的含义)，改为忽略大小写匹配。
+    所有规则合并为一个正则，每个标签只需扫描一次
+    """
+
+    def __init__(self, rules: Iterable[str], aliases: dict[str, str] | None = None):
+        literals = set()
+        patterns = []
+        for rule in rules:
+            if rule.startswith(REGEX_PREFIX):
+                pattern = _simplify(rule[len(REGEX_PREFIX):])
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    logger.warning(f"忽略无效的标签规则 {rule}：{e}")
+                    continue
+                patterns.append(f"(?:{pattern})")
+            elif normalized := normalize_tag(rule):
+                literals.add(re.escape(normalized))
+
+        # 较长的字面量放在前面，避免被其前缀抢先匹配
+        alternatives = sorted(literals, key=len, reverse=True) + patterns
+        self.pattern = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+        self.aliases = {normalize_tag(alias): normalize_tag(tag) for alias, tag in (aliases or {}).items()}
+
+    def canonical(self, tag: str) -> str:
+        """ 返回标签标准化并替换别名后的形式 """
+        normalized = normalize_tag(tag)
+        return self.aliases.get(normalized, normalized)
+
+    def find(self, tags: Iterable[str]) -> str | None:
+        """ 返回第一个命中规则的标签，没有命中时返回 None """
+        if self.pattern is None:
+            return None
+
+        for tag in tags:
+            if self.pattern.search(self.canonical(tag)):
+                return tag
+        return None
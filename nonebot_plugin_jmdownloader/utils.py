@@ -1,120 +1,345 @@
 import asyncio
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable
+from contextlib import contextmanager
 from io import BytesIO
-
-import httpx
-from jmcomic import (JmcomicClient, JmcomicException, JmDownloader,
-                     JmModuleConfig, JmPhotoDetail, JmSearchPage,
+import json
+import math
+from pathlib import Path
+import time
+from uuid import uuid4
+
+from jmcomic import (ExceptionTool, JmAlbumDetail, JmcomicClient,
+                     JmcomicException, JmPhotoDetail, JmSearchPage,
                      JsonResolveFailException, MissingAlbumPhotoException,
                      RequestRetryAllFailException)
 from nonebot import logger
 from nonebot.adapters.onebot.v11 import (Bot, GroupMessageEvent, MessageEvent,
                                          PrivateMessageEvent)
-from nonebot.adapters.onebot.v11.exception import ActionFailed
+from nonebot.adapters.onebot.v11.exception import ActionFailed, NetworkError
+from nonebot.matcher import Matcher
 from nonebot.rule import Rule
-from PIL import Image, ImageFilter
 
+from .cache import (PdfArtifact, PhotoMeta, TTLCache, cover_cache,
+                    metadata_cache, pdf_cache, photo_version)
+from .concurrency import (DownloadQueue, RateLimiter, SingleFlight,
+                          bulk_executor, metadata_executor)
+from .config import plugin_cache_dir, plugin_config
 from .data_source import data_manager
-
-sem = asyncio.Semaphore(10)
+from .image import blur_thumbnail, image_worker
+from .network import get_from_image_domains, http_client
+from .pdf import PdfDownloader
+from .session import PooledClient, jm_pool
+
+sem = asyncio.Semaphore(plugin_config.jmcomic_cover_concurrency)
+photo_info_flight = SingleFlight()
+# 查询后短时间内下载同一本子时，直接复用完整的章节信息
+photo_cache = TTLCache(64, 600)
+download_flight = SingleFlight()
+album_info_flight = SingleFlight()
+download_queue = DownloadQueue(plugin_config.jmcomic_download_workers)
+search_flight = SingleFlight()
+search_cache = TTLCache(plugin_config.jmcomic_search_cache_size, plugin_config.jmcomic_search_cache_ttl)
+search_timings: deque["StageTimer"] = deque(maxlen=20)
 
 #region API与下载相关函数
+async def require_client(matcher: type[Matcher]) -> PooledClient:
+    """获取客户端池，还没有会话登录成功时等待，超时则结束指令"""
+    client = await jm_pool.get_client(plugin_config.jmcomic_login_timeout)
+    if client is None:
+        await matcher.finish("JMComic 正在登录，请稍后再试")
+    return client
+
+def log_jmcomic_error(e: JmcomicException):
+    """记录 jmcomic 请求失败的原因"""
+    if isinstance(e, JsonResolveFailException):
+        resp = e.resp
+        logger.error(f"错误：解析 JSON 失败 (HTTP {resp.status_code})\n响应内容: {resp.text}")
+    elif isinstance(e, RequestRetryAllFailException):
+        logger.error("错误：请求失败，已达最大重试次数。")
+    else:
+        logger.error(f"JMComic 发生未知错误: {e}")
+
 def get_photo_info(client: JmcomicClient, photo_id):
     """获取章节信息和 Bot 要发送的消息"""
     try:
         photo = client.get_photo_detail(photo_id)
+        metadata_cache.set(PhotoMeta.from_photo(photo))
         return photo
 
     except MissingAlbumPhotoException as e:
+        metadata_cache.set_missing(photo_id)
         raise e
 
-    except JsonResolveFailException as e:
-        resp = e.resp
-        logger.error(f'错误：解析 JSON 失败 (HTTP {resp.status_code})\n响应内容: {resp.text}')
-
-    except RequestRetryAllFailException:
-        logger.error('错误：请求失败，已达最大重试次数。')
-
     except JmcomicException as e:
-        logger.error(f'JMComic 发生未知错误: {e}')
+        log_jmcomic_error(e)
 
     return None
 
-async def get_photo_info_async(client: JmcomicClient, photo_id):
-    return await asyncio.to_thread(get_photo_info, client, photo_id)
+async def get_photo_info_async(client: JmcomicClient, photo_id) -> JmPhotoDetail | None:
+    """获取完整的章节信息，短时间内重复获取时使用内存缓存，同一jm号的并发查询只请求一次"""
+    photo = photo_cache.get(str(photo_id))
+    if photo is not None:
+        return photo
+
+    async def fetch() -> JmPhotoDetail | None:
+        photo = await metadata_executor.run(get_photo_info, client, photo_id)
+        # TTLCache 不是线程安全的，回到事件循环后再写入
+        if photo is not None:
+            photo_cache.set(str(photo_id), photo)
+        return photo
+
+    return await photo_info_flight.do(str(photo_id), fetch)
 
+def get_cached_photo_meta(photo_id) -> PhotoMeta | None:
+    """从本子信息缓存中获取章节的基本信息，不需要客户端；缓存为不存在时抛出 MissingAlbumPhotoException"""
+    if metadata_cache.is_missing(photo_id):
+        raise MissingAlbumPhotoException(
+            f"jm{photo_id} 不存在（缓存）", {ExceptionTool.CONTEXT_KEY_MISSING_JM_ID: str(photo_id)}
+        )
+    return metadata_cache.get(photo_id)
 
-def download_photo(client: JmcomicClient, downloader: JmDownloader, photo: JmPhotoDetail):
+async def get_photo_meta_async(client: JmcomicClient, photo_id) -> PhotoMeta | None:
+    """获取章节的基本信息，优先使用本子信息缓存，不存在的jm号抛出 MissingAlbumPhotoException"""
+    meta = get_cached_photo_meta(photo_id)
+    if meta is not None:
+        return meta
+
+    photo = await get_photo_info_async(client, photo_id)
+    return PhotoMeta.from_photo(photo) if photo is not None else None
+
+
+def get_cached_pdf(photo_id) -> PdfArtifact | None:
+    """查找PDF缓存，内存中有刚获取的章节信息时按章节版本校验缓存"""
+    photo = photo_cache.get(str(photo_id))
+    return pdf_cache.get(photo_id, photo_version(photo) if photo is not None else None)
+
+
+def download_photo(client: JmcomicClient, downloader: PdfDownloader, photo: JmPhotoDetail) -> list[Path] | None:
+    """下载章节并转为PDF，返回放入缓存后的各卷PDF路径"""
     try:
         with downloader as dler:
             dler.download_by_photo_detail(photo, client)
-        return True
-    except JmcomicException as e:
+    except (JmcomicException, OSError) as e:
         logger.error(f"JMComic 下载失败: {e}")
-        return False
+        return None
+
+    pdf_paths = downloader.outputs.pop(photo.photo_id, None)
+    if not pdf_paths:
+        logger.error(f"jm{photo.id} PDF生成失败")
+        return None
+
+    return pdf_cache.put(photo, pdf_paths)
+
+async def download_photo_async(
+    client: JmcomicClient,
+    downloader: PdfDownloader,
+    photo: JmPhotoDetail,
+    group_key: Hashable = None,
+    user_key: Hashable = None,
+    priority: bool = False,
+    on_queued: Callable[[int], Awaitable] | None = None,
+):
+    """在下载队列中下载章节，同一jm号的并发下载共享一次下载，所有等待者得到同一个PDF"""
+    return await download_flight.do(
+        str(photo.id),
+        lambda: download_queue.run(
+            lambda: bulk_executor.run(download_photo, client, downloader, photo),
+            group_key, user_key, priority, on_queued
+        )
+    )
+
+
+def get_album_info(client: JmcomicClient, album_id) -> JmAlbumDetail | None:
+    """获取本子信息和章节列表"""
+    try:
+        return client.get_album_detail(album_id)
+
+    except MissingAlbumPhotoException as e:
+        raise e
 
-async def download_photo_async(client: JmcomicClient, downloader: JmDownloader, photo: JmPhotoDetail):
-    return await asyncio.to_thread(download_photo, client, downloader, photo)
+    except JmcomicException as e:
+        log_jmcomic_error(e)
+
+    return None
+
+async def get_album_info_async(client: JmcomicClient, album_id) -> JmAlbumDetail | None:
+    """获取本子信息和章节列表，同一本子的并发查询只请求一次"""
+    return await album_info_flight.do(
+        str(album_id), lambda: metadata_executor.run(get_album_info, client, album_id)
+    )
+
+async def download_album_async(
+    client: JmcomicClient,
+    downloader: PdfDownloader,
+    album: JmAlbumDetail,
+    use_cache: bool = True,
+    group_key: Hashable = None,
+    user_key: Hashable = None,
+    priority: bool = False,
+) -> list[tuple[JmPhotoDetail | None, list[Path] | None]]:
+    """
+    并行下载本子的所有章节，按章节顺序返回 (章节信息, 各卷PDF路径)，失败的章节路径为 None
+
+    同时下载的章节数受配置限制，每个章节仍单独在下载队列中排队，与其他下载共享同一份并发额度。
+    use_cache 为 False 时不直接使用PDF缓存，确保章节图片都在本地(用于合并)
+    """
+    semaphore = asyncio.Semaphore(max(1, plugin_config.jmcomic_album_concurrency))
+
+    async def download_chapter(index: int) -> tuple[JmPhotoDetail | None, list[Path] | None]:
+        photo_id = album.getindex(index).photo_id
+        if use_cache and (artifact := get_cached_pdf(photo_id)):
+            return None, pdf_cache.paths_of(artifact)
+
+        async with semaphore:
+            try:
+                photo = await get_photo_info_async(client, photo_id)
+            except MissingAlbumPhotoException:
+                return None, None
+            if photo is None:
+                return None, None
 
+            return photo, await download_photo_async(client, downloader, photo, group_key, user_key, priority)
 
-def search_album(client: JmcomicClient, search_query: str):
+    return await asyncio.gather(*(download_chapter(index) for index in range(len(album))))
+
+async def merge_album_async(
+    downloader: PdfDownloader, album: JmAlbumDetail, photos: list[JmPhotoDetail]
+) -> list[Path] | None:
+    """将已下载的各章节合并为一个PDF(按配置分卷)，每次合并使用独立的文件名，同时合并同一本子时互不影响"""
+    output = plugin_cache_dir / f"{album.album_id}_merged_{uuid4().hex[:8]}.pdf"
     try:
-        page = client.search_site(search_query=search_query, page=1)
-        return page
+        return await bulk_executor.run(downloader.merge, photos, output, album.name)
+    except OSError as e:
+        logger.error(f"jm{album.album_id} 合并PDF失败: {e}")
+        return None
 
-    except JsonResolveFailException as e:
-        resp = e.resp
-        logger.error(f'错误：解析 JSON 失败 (HTTP {resp.status_code})\n响应内容: {resp.text}')
 
-    except RequestRetryAllFailException:
-        logger.error('错误：请求失败，已达最大重试次数。')
+def search_album(client: JmcomicClient, search_query: str, page: int = 1):
+    try:
+        page = client.search_site(search_query=search_query, page=page)
+        return page
 
     except JmcomicException as e:
-        logger.error(f'JMComic 发生未知错误: {e}')
+        log_jmcomic_error(e)
 
     return None
 
-async def search_album_async(client: JmcomicClient, search_query: str):
-    return await asyncio.to_thread(search_album, client, search_query)
+def normalize_query(search_query: str) -> str:
+    """合并多余空白并忽略大小写，作为搜索缓存的键"""
+    return " ".join(search_query.split()).casefold()
+
+async def search_album_async(client: JmcomicClient, search_query: str, page: int = 1) -> JmSearchPage | None:
+    """搜索本子，结果按 关键词+页码 缓存，相同的并发搜索只请求一次"""
+    key = (normalize_query(search_query), page)
+    result = search_cache.get(key)
+    if result is not None:
+        return result
+
+    result = await search_flight.do(key, lambda: metadata_executor.run(search_album, client, search_query, page))
+    if result is not None:
+        search_cache.set(key, result)
+    return result
+
+async def prefetch_search_page(client: JmcomicClient, search_query: str, page: int):
+    """后台预取下一页的搜索结果和封面，被禁止的本子不会展示，不预取其封面"""
+    result = await search_album_async(client, search_query, page)
+    if result is not None:
+        await get_blurred_covers([
+            album_id
+            for album_id, _, tags in result.iter_id_title_tag()
+            if not data_manager.is_album_restricted(album_id, tags)
+        ])
 
 
 async def download_avatar(album_id: int | str) -> BytesIO | None:
-    """下载本子封面，限制并发数量"""
+    """下载本子封面，限制并发数量，按域名健康度依次尝试"""
     async with sem:
-        for domain in JmModuleConfig.DOMAIN_IMAGE_LIST:
-            url = f"https://{domain}/media/albums/{album_id}.jpg"
+        response = await get_from_image_domains(f"/media/albums/{album_id}.jpg")
 
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(url, timeout=40)
-                    response.raise_for_status()
+        if response is None:
+            return None
 
-                    if not response.content or len(response.content) < 1024:
-                        logger.warning(f"{album_id} 可能返回了错误页面，无法下载封面")
-                        return None
+        if not response.content or len(response.content) < 1024:
+            logger.warning(f"{album_id} 可能返回了错误页面，无法下载封面")
+            return None
 
-                    return BytesIO(response.content)
+        return BytesIO(response.content)
+
+
+async def blur_image_async(image_bytes: BytesIO) -> BytesIO:
+    data = await image_worker.run(
+        blur_thumbnail,
+        image_bytes.getvalue(),
+        plugin_config.jmcomic_cover_max_size,
+        7,
+        plugin_config.jmcomic_cover_quality,
+    )
+    return BytesIO(data)
 
-            except (httpx.HTTPStatusError, httpx.RequestError):
-                continue
 
-        logger.warning(f"{album_id} 封面下载失败：所有域名不可用")
-        return None
 
+class StageTimer:
+    """记录一次请求各阶段的耗时"""
 
-def blur_image(image_bytes: BytesIO) -> BytesIO:
-    """对图片进行模糊处理"""
-    image = Image.open(image_bytes)
-    blurred_image = image.filter(ImageFilter.GaussianBlur(radius=7))
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        self.stages: dict[str, list[float]] = {}
 
-    output = BytesIO()
-    blurred_image.save(output, format="JPEG")
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.setdefault(name, []).append(time.perf_counter() - start)
 
-    output.seek(0)
+    def finish(self):
+        self.finished = time.perf_counter()
 
-    return output
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
 
-async def blur_image_async(image_bytes: BytesIO):
-    return await asyncio.to_thread(blur_image, image_bytes)
+    def summary(self) -> str:
+        parts = [f"总耗时{self.elapsed:.2f}s"]
+        for name, durations in self.stages.items():
+            if len(durations) == 1:
+                parts.append(f"{name}{durations[0]:.2f}s")
+            else:
+                parts.append(f"{name}{len(durations)}次(累计{sum(durations):.2f}s，最长{max(durations):.2f}s)")
+        return "，".join(parts)
+
+
+async def get_blurred_cover(album_id: int | str, timer: StageTimer | None = None) -> BytesIO | None:
+    """获取模糊后的封面，优先使用缓存，下载完成后立即模糊"""
+    timer = timer or StageTimer()
+
+    with timer.stage("读取缓存"):
+        data = await metadata_executor.run(cover_cache.get, album_id)
+    if data is not None:
+        return BytesIO(data)
+
+    with timer.stage("下载封面"):
+        avatar = await download_avatar(album_id)
+    if avatar is None:
+        return None
+
+    with timer.stage("模糊封面"):
+        blurred = await blur_image_async(avatar)
+
+    await metadata_executor.run(cover_cache.put, album_id, blurred.getvalue())
+    return blurred
+
+async def get_blurred_covers(album_ids: list[int | str], timer: StageTimer | None = None) -> list[BytesIO | None]:
+    """
+    并发获取一批模糊封面
+
+    每张封面各自走 缓存→下载→模糊 的流程，先下载完的先模糊，
+    下载并发受 sem 限制，模糊并发受图片处理进程数限制
+    """
+    return list(await asyncio.gather(*(get_blurred_cover(album_id, timer) for album_id in album_ids)))
 
 # endregion
 
@@ -126,7 +351,128 @@ async def send_forward_message(bot: Bot, event: MessageEvent, messages: list):
         await bot.call_api("send_private_forward_msg", user_id=event.user_id, messages=messages)
 
 
+async def upload_file(bot: Bot, event: MessageEvent, file_path: Path, name: str):
+    """ 上传文件到群文件（优先上传到本群设置的文件夹）或私聊，大文件上传耗时较长，使用单独的超时时间 """
+    timeout = plugin_config.jmcomic_upload_timeout
+    if isinstance(event, GroupMessageEvent):
+        params = {"group_id": event.group_id, "file": file_path.as_posix(), "name": name, "_timeout": timeout}
+        folder_id = data_manager.get_group_folder_id(event.group_id)
+        if folder_id:
+            params["folder_id"] = folder_id
+        await bot.call_api("upload_group_file", **params)
+
+    elif isinstance(event, PrivateMessageEvent):
+        await bot.call_api(
+            "upload_private_file", user_id=event.user_id, file=file_path.as_posix(), name=name, _timeout=timeout
+        )
+
+
+async def upload_volumes(bot: Bot, event: MessageEvent, file_paths: list[Path], name: str) -> list[int]:
+    """
+    并发上传本子的各卷，同时上传的卷数受配置限制，失败的卷单独重试
+
+    只有一卷时文件名为 name.pdf，否则为 name_partN.pdf，返回最终仍上传失败的卷号
+    """
+    semaphore = asyncio.Semaphore(max(1, plugin_config.jmcomic_upload_concurrency))
+    retries = max(0, plugin_config.jmcomic_upload_retries)
+
+    async def upload(number: int, file_path: Path) -> bool:
+        filename = f"{name}.pdf" if len(file_paths) == 1 else f"{name}_part{number}.pdf"
+        for attempt in range(retries + 1):
+            try:
+                async with semaphore:
+                    await upload_file(bot, event, file_path, filename)
+                return True
+            except (ActionFailed, NetworkError) as e:
+                # 超时由适配器抛出 NetworkError，与上传失败一样重试
+                logger.warning(f"上传 {filename} 失败（第{attempt + 1}次）：{e}")
+                if attempt < retries:
+                    await asyncio.sleep(2 ** attempt)
+        return False
+
+    results = await asyncio.gather(*(upload(number, path) for number, path in enumerate(file_paths, 1)))
+    return [number for number, ok in enumerate(results, 1) if not ok]
+
+
+#region 导入导出
+def read_local_file(source: str) -> bytes | None:
+    """ 读取本地文件，不存在时返回 None """
+    path = Path(source).expanduser()
+    return path.read_bytes() if path.is_file() else None
+
+async def read_import_source(bot: Bot, event: MessageEvent, source: str) -> bytes | None:
+    """ 读取本地文件，不存在时在群聊中按文件名查找群文件，都找不到时返回 None """
+    content = await metadata_executor.run(read_local_file, source)
+    if content is not None:
+        return content
+
+    if not isinstance(event, GroupMessageEvent):
+        return None
+
+    root_data = await bot.call_api("get_group_root_files", group_id=event.group_id)
+    for file_item in root_data.get("files") or []:
+        if file_item.get("file_name") == source:
+            file_data = await bot.call_api(
+                "get_group_file_url",
+                group_id=event.group_id,
+                file_id=file_item.get("file_id"),
+                busid=file_item.get("busid")
+            )
+            response = await http_client.get(file_data["url"], timeout=60)
+            response.raise_for_status()
+            return response.content
+
+    return None
+
+
+def parse_import_content(content: bytes) -> dict:
+    """
+    解析导入文件
+
+    JSON 文件按 jm导出 的格式读取；其他文本文件按空白或逗号分隔，
+    纯数字视为jm号，其余视为tag，# 开头的行为注释
+    """
+    text = content.decode("utf-8-sig")
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        return data
+
+    jm_ids, tags = [], []
+    for line in text.splitlines():
+        if line.lstrip().startswith("#"):
+            continue
+        for item in line.replace(",", " ").replace("，", " ").split():
+            (jm_ids if item.isdigit() else tags).append(item)
+
+    return {"restricted_ids": jm_ids, "restricted_tags": tags}
+
+#endregion
+
+
 #region 权限相关
+user_rate_limiter = RateLimiter(plugin_config.jmcomic_user_rate_limit, plugin_config.jmcomic_rate_limit_window)
+group_rate_limiter = RateLimiter(plugin_config.jmcomic_group_rate_limit, plugin_config.jmcomic_rate_limit_window)
+
+
+def rate_limit_wait(bot: Bot, event: MessageEvent) -> int:
+    """ 检查用户和所在群的指令频率，未超限时记录本次使用并返回0，否则返回需等待的秒数 """
+    if str(event.user_id) in bot.config.superusers:
+        return 0
+
+    limits = [(user_rate_limiter, event.user_id)]
+    if isinstance(event, GroupMessageEvent):
+        limits.append((group_rate_limiter, event.group_id))
+
+    wait = max(limiter.wait_time(key) for limiter, key in limits)
+    if wait <= 0:
+        for limiter, key in limits:
+            limiter.hit(key)
+        return 0
+    return math.ceil(wait)
+
 async def check_permission(bot: Bot, group_id: int, operator_id: int, target_id: int) -> bool:
     """增减群黑名单权限检查"""
     if str(operator_id) in bot.config.superusers:
@@ -0,0 +1,85 @@
+import asyncio
+
+
+async def start_queue(order: list[str]):
+    """返回只有一个名额的队列和占住名额的任务，set 返回的事件后释放名额"""
+    from nonebot_plugin_jmdownloader.concurrency import DownloadQueue
+
+    queue = DownloadQueue(1)
+    gate = asyncio.Event()
+
+    async def blocker():
+        order.append("blocker")
+        await gate.wait()
+
+    task = asyncio.create_task(queue.run(blocker, "g0", "u0"))
+    await asyncio.sleep(0)
+    return queue, gate, task
+
+
+def enqueue(queue, order: list[str], name: str, group_key, user_key, **kwargs) -> asyncio.Task:
+    async def job():
+        order.append(name)
+
+    return asyncio.create_task(queue.run(job, group_key, user_key, **kwargs))
+
+
+async def test_round_robin_between_groups_and_users():
+    order = []
+    queue, gate, blocker = await start_queue(order)
+
+    tasks = []
+    for name, group_key, user_key in [
+        ("a1", "g1", "u1"),
+        ("a2", "g1", "u1"),
+        ("a3", "g1", "u1"),
+        ("b1", "g1", "u2"),
+        ("c1", "g2", "u3"),
+    ]:
+        tasks.append(enqueue(queue, order, name, group_key, user_key))
+        await asyncio.sleep(0)
+    assert queue.waiting == 5
+
+    gate.set()
+    await asyncio.gather(blocker, *tasks)
+    assert order == ["blocker", "a1", "c1", "b1", "a2", "a3"]
+    assert queue.running == 0
+
+
+async def test_priority_runs_first():
+    order = []
+    queue, gate, blocker = await start_queue(order)
+    positions = []
+
+    async def on_queued(position: int):
+        positions.append(position)
+
+    normal = enqueue(queue, order, "normal", "g1", "u1", on_queued=on_queued)
+    await asyncio.sleep(0)
+    priority = enqueue(queue, order, "priority", "g2", "u2", priority=True, on_queued=on_queued)
+    await asyncio.sleep(0)
+    assert positions == [0, 0]
+
+    gate.set()
+    await asyncio.gather(blocker, normal, priority)
+    assert order == ["blocker", "priority", "normal"]
+
+
+async def test_cancelled_waiter_is_skipped():
+    order = []
+    queue, gate, blocker = await start_queue(order)
+
+    cancelled = enqueue(queue, order, "cancelled", "g1", "u1")
+    kept = enqueue(queue, order, "kept", "g1", "u1")
+    await asyncio.sleep(0)
+    assert queue.waiting == 2
+
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    assert queue.waiting == 1
+
+    gate.set()
+    await asyncio.gather(blocker, kept)
+    assert order == ["blocker", "kept"]
+    assert queue.running == 0
+    assert queue.waiting == 0
@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def new_manager(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """返回在临时数据目录中创建数据管理器的函数，多次调用相当于重启"""
+    from nonebot_plugin_jmdownloader import data_source
+
+    monkeypatch.setattr(data_source, "get_plugin_data_dir", lambda: tmp_path)
+    return data_source.JmComicDataManager
+
+
+def test_journal_replay_after_restart(new_manager):
+    manager = new_manager()
+    manager.add_restricted_jm_id("123")
+    manager.add_blacklist(1, 2)
+    manager.set_group_enabled(1, True)
+    assert manager.journal_path.exists()
+
+    restarted = new_manager()
+    assert restarted.is_jm_id_restricted("123")
+    assert restarted.is_user_blacklisted(1, 2)
+    assert restarted.is_group_enabled(1)
+
+    # 重放后合并进快照，日志被清空
+    assert not restarted.journal_path.exists()
+    snapshot = json.loads(restarted.filepath.read_text(encoding="utf-8"))
+    assert "123" in snapshot["restricted_ids"]
+
+
+def test_journal_skips_truncated_last_line(new_manager):
+    manager = new_manager()
+    manager.add_restricted_jm_id("123")
+    with manager.journal_path.open("a", encoding="utf-8") as f:
+        f.write('{"op": "add", "path": ["restricted_ids"], "val')
+
+    restarted = new_manager()
+    assert restarted.is_jm_id_restricted("123")
+    assert restarted.data["restricted_ids"] == ["123"]
+
+
+def test_journal_compacts_at_threshold(new_manager, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(new_manager, "COMPACT_THRESHOLD", 10)
+    manager = new_manager()
+    ids = [str(i) for i in range(manager.COMPACT_THRESHOLD - manager._journal_size)]
+    for jm_id in ids[:-1]:
+        manager.add_restricted_jm_id(jm_id)
+    assert manager.journal_path.exists()
+
+    manager.add_restricted_jm_id(ids[-1])
+    assert not manager.journal_path.exists()
+    assert manager._journal_size == 0
+    snapshot = json.loads(manager.filepath.read_text(encoding="utf-8"))
+    assert snapshot["restricted_ids"] == ids
+
+
+def test_indexes_rebuilt_after_replay(new_manager):
+    manager = new_manager()
+    manager.add_restricted_jm_ids(["1", "2", "3"])
+    manager.remove_restricted_jm_ids(["2"])
+    manager.add_restricted_tag("测试")
+    manager.add_forbidden_album("100")
+    manager.add_blacklist(1, 2)
+    manager.remove_blacklist(1, 2)
+    manager.add_blacklist(1, 3)
+
+    restarted = new_manager()
+    assert restarted.is_jm_id_restricted("1")
+    assert not restarted.is_jm_id_restricted("2")
+    assert restarted.is_jm_id_restricted("3")
+    assert restarted.has_restricted_tag(["测试"])
+    assert restarted.is_forbidden_album("100")
+    assert not restarted.is_user_blacklisted(1, 2)
+    assert restarted.is_user_blacklisted(1, 3)
+
+
+def test_import_data_is_all_or_nothing(new_manager):
+    manager = new_manager()
+    before = json.dumps(manager.export_data())
+
+    with pytest.raises(ValueError, match="notint"):
+        manager.import_data({"restricted_ids": ["x1"], "user_limits": {"a": "notint"}})
+    assert json.dumps(manager.export_data()) == before
+    assert not manager.is_jm_id_restricted("x1")
+
+
+def test_import_journals_only_changed_users(new_manager):
+    manager = new_manager()
+    manager.set_user_limits({"1": 5, "2": 5})
+    manager.save()
+
+    manager.import_data({"user_limits": {"1": 5, "2": "3"}})
+    records = [json.loads(line) for line in manager.journal_path.read_text(encoding="utf-8").splitlines()]
+    assert records == [{"op": "set", "path": ["user_limits", "2"], "value": 3}]
+
+    restarted = new_manager()
+    assert restarted.get_user_limit(1) == 5
+    assert restarted.get_user_limit(2) == 3
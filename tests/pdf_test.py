@@ -0,0 +1,88 @@
+from io import BytesIO
+from pathlib import Path
+import re
+
+from PIL import Image
+import pytest
+
+
+def make_pages(directory: Path, count: int) -> list[Path]:
+    """生成 count 张大小不同的 JPEG 图片，返回按页码排列的路径"""
+    paths = []
+    for index in range(count):
+        output = BytesIO()
+        Image.new("RGB", (100 + index, 150), (index * 40 % 256, 0, 0)).save(output, format="JPEG")
+        path = directory / f"{index + 1:05}.jpg"
+        path.write_bytes(output.getvalue())
+        paths.append(path)
+    return paths
+
+
+def page_count(path: Path) -> int:
+    return len(re.findall(rb"/Type /Page\b", path.read_bytes()))
+
+
+def test_out_of_order_pages(tmp_path: Path):
+    from nonebot_plugin_jmdownloader.pdf import StreamingPdfWriter
+
+    paths = make_pages(tmp_path, 3)
+    output = tmp_path / "out.pdf"
+    writer = StreamingPdfWriter(output, paths, title="测试")
+
+    writer.page_done(2)
+    assert writer.pages_written == 0
+    writer.page_done(0)
+    assert writer.pages_written == 1
+    writer.page_done(1)
+    assert writer.pages_written == 3
+
+    assert writer.finish() == [output]
+    data = output.read_bytes()
+    assert data.startswith(b"%PDF-1.4")
+    assert data.endswith(b"%%EOF\n")
+    # 页面按页码顺序排列，宽度依次为 100、101、102 像素
+    widths = [int(width) for width in re.findall(rb"/Width (\d+)", data)]
+    assert widths == [100, 101, 102]
+
+
+def test_volume_split(tmp_path: Path):
+    from nonebot_plugin_jmdownloader.pdf import StreamingPdfWriter
+
+    paths = make_pages(tmp_path, 5)
+    output = tmp_path / "out.pdf"
+    writer = StreamingPdfWriter(output, paths, volume_pages=2)
+    for index in range(5):
+        writer.page_done(index)
+
+    volumes = writer.finish()
+    assert [path.name for path in volumes] == ["out_part1.pdf", "out_part2.pdf", "out_part3.pdf"]
+    assert [page_count(path) for path in volumes] == [2, 2, 1]
+    assert not output.exists()
+
+
+def test_single_volume_renamed(tmp_path: Path):
+    from nonebot_plugin_jmdownloader.pdf import StreamingPdfWriter
+
+    paths = make_pages(tmp_path, 3)
+    output = tmp_path / "out.pdf"
+    writer = StreamingPdfWriter(output, paths, volume_pages=10)
+
+    # 未触发回调的页在结束时从磁盘补上
+    assert writer.finish() == [output]
+    assert page_count(output) == 3
+    assert not (tmp_path / "out_part1.pdf").exists()
+
+
+def test_missing_page(tmp_path: Path):
+    from nonebot_plugin_jmdownloader.pdf import StreamingPdfWriter
+
+    paths = make_pages(tmp_path, 3)
+    paths[1].unlink()
+    output = tmp_path / "out.pdf"
+    writer = StreamingPdfWriter(output, paths)
+
+    with pytest.raises(FileNotFoundError, match="缺少第2页"):
+        writer.finish()
+    writer.abort()
+    assert not output.exists()
+    assert not list(tmp_path.glob("*.part"))
@@ -0,0 +1,39 @@
+def test_substring_match():
+    from nonebot_plugin_jmdownloader.tag_rules import TagMatcher
+
+    matcher = TagMatcher(["重口", "YAOI"])
+    assert matcher.find(["纯爱", "重口味"]) == "重口味"
+    assert matcher.find(["Yaoi 合集"]) == "Yaoi 合集"
+    assert matcher.find(["纯爱", "口味"]) is None
+
+
+def test_traditional_and_simplified():
+    from nonebot_plugin_jmdownloader.tag_rules import TagMatcher
+
+    assert TagMatcher(["獵奇"]).find(["猎奇"]) == "猎奇"
+    assert TagMatcher(["猎奇"]).find(["獵 奇"]) == "獵 奇"
+
+
+def test_alias():
+    from nonebot_plugin_jmdownloader.tag_rules import TagMatcher
+
+    matcher = TagMatcher(["猎奇"], aliases={"Gore": "獵奇"})
+    assert matcher.find(["GORE"]) == "GORE"
+    assert matcher.find(["gorgeous"]) is None
+
+
+def test_regex_rules_are_normalized():
+    from nonebot_plugin_jmdownloader.tag_rules import TagMatcher
+
+    assert TagMatcher(["re:^獵奇.*$"]).find(["猎奇向"]) == "猎奇向"
+    assert TagMatcher(["re:^full color$"]).find(["Full Color"]) == "Full Color"
+    assert TagMatcher([r"re:^\S+本$"]).find(["同人本"]) == "同人本"
+    assert TagMatcher(["re:^猎奇$"]).find(["猎奇向"]) is None
+
+
+def test_invalid_regex_is_ignored():
+    from nonebot_plugin_jmdownloader.tag_rules import TagMatcher
+
+    matcher = TagMatcher(["re:(", "重口"])
+    assert matcher.find(["重口味"]) == "重口味"
+    assert TagMatcher(["re:["]).find(["["]) is None